@@ -0,0 +1,6 @@
+# benchmarks/__init__.py
+"""
+Mediciones de rendimiento del procesamiento con datos sintéticos.
+
+    python -m benchmarks.bench_pipeline --tamanos 1000 10000
+"""
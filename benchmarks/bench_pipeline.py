@@ -0,0 +1,229 @@
+# benchmarks/bench_pipeline.py
+"""
+Mide el tiempo de cada fase del procesamiento (lectura, filtro, intercalado, apertura de
+la plantilla, escritura, resumen de cobranza y guardado) y la memoria máxima (RSS) con libros sintéticos de
+distintos tamaños, y compara el resultado con una línea base guardada.
+
+    python -m benchmarks.bench_pipeline --tamanos 1000 10000 100000 500000
+    python -m benchmarks.bench_pipeline --tamanos 10000 --guardar-baseline
+
+Cada medición se ejecuta en un proceso nuevo, para que la memoria máxima y las
+importaciones de una corrida no afecten a la siguiente. El código de salida es 1 si
+alguna fase es más lenta que la línea base por encima de la tolerancia.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.generar_datos import PLANTILLA_REAL, generate_origin, generate_template
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+TAMANOS_POR_DEFECTO = [1000, 10000, 100000, 500000]
+FASES = ["lectura", "filtro", "intercalado", "apertura", "escritura", "resumen", "guardado"]
+BASELINE_POR_DEFECTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DATOS_POR_DEFECTO = os.path.join(tempfile.gettempdir(), "facturacion_bench")
+TOLERANCIA_POR_DEFECTO = 0.20
+# Las fases más rápidas que esto no se comparan: el ruido domina la medición.
+SEGUNDOS_MINIMOS_COMPARACION = 0.05
+
+
+def peak_rss_mb():
+    """Memoria máxima (RSS) del proceso actual en MB, o None si no se puede medir."""
+    if resource is not None:
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux la informa en KB, macOS en bytes.
+        return maximo / (1024 * 1024) if sys.platform == "darwin" else maximo / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    return None
+
+
+def _run_once(origin_path, template_path, motor, filas_por_bloque):
+    """Una corrida completa, fase por fase. Se ejecuta en un proceso nuevo."""
+    from facturacion.processor import FacturacionProcessor
+    from facturacion.writers import create_writer
+
+    processor = FacturacionProcessor()
+    processor.FILAS_POR_BLOQUE = filas_por_bloque
+    tiempos = {}
+
+    def medir(fase, funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos[fase] = tiempos.get(fase, 0.0) + time.perf_counter() - inicio
+        return resultado
+
+    advertencias = []
+    df_origen = medir("lectura", processor.read_origin, origin_path)
+    rutas = processor.routes()
+    hojas_raw = medir("filtro", processor.split_origin, df_origen, advertencias, rutas)
+    hojas = {ruta['hoja']: medir("intercalado", processor._interleave_agents, hojas_raw[ruta['hoja']], ruta['agentes'])
+             for ruta in rutas}
+
+    writer = medir("apertura", create_writer, motor)
+    try:
+        medir("apertura", writer.open, template_path)
+        for ruta in rutas:
+            medir("escritura", processor._process_single_sheet, writer, ruta['hoja'], hojas[ruta['hoja']], ruta['colores'])
+        resumen = medir("resumen", processor.summarize_collections, hojas)
+        medir("resumen", processor._write_summary, writer, resumen)
+        medir("guardado", writer.save)
+    finally:
+        writer.close(save=False)
+        writer.quit()
+
+    return {
+        "filas_origen": len(df_origen),
+        "filas_escritas": sum(len(df_hoja) for df_hoja in hojas.values()),
+        "tiempos": tiempos,
+        "rss_max_mb": peak_rss_mb(),
+    }
+
+
+def _run_in_fresh_process(origin_path, template_path, motor, filas_por_bloque):
+    contexto = multiprocessing.get_context("spawn")
+    with contexto.Pool(1) as pool:
+        return pool.apply(_run_once, (origin_path, template_path, motor, filas_por_bloque))
+
+
+def ensure_data(directorio, tamano, extension_plantilla):
+    """Genera (o reutiliza) el libro de origen del tamaño indicado y la plantilla base."""
+    os.makedirs(directorio, exist_ok=True)
+    origen = os.path.join(directorio, f"origen_{tamano}.xlsx")
+    if not os.path.exists(origen):
+        print(f"Generando {origen} ...", file=sys.stderr)
+        generate_origin(origen, tamano)
+    plantilla = os.path.join(directorio, f"plantilla{extension_plantilla}")
+    if not os.path.exists(plantilla):
+        generate_template(plantilla)
+    return origen, plantilla
+
+
+def run_benchmark(tamanos, motor, directorio, repeticiones, filas_por_bloque=10000):
+    """
+    Ejecuta las mediciones y devuelve {tamaño: resultado}. Con varias repeticiones se
+    queda con el menor tiempo de cada fase y la mayor memoria.
+    """
+    extension = ".xlsm" if os.path.exists(PLANTILLA_REAL) else ".xlsx"
+
+    resultados = {}
+    for tamano in tamanos:
+        origen, plantilla_base = ensure_data(directorio, tamano, extension)
+        corridas = []
+        for _ in range(repeticiones):
+            # Cada corrida escribe sobre una copia limpia de la plantilla.
+            plantilla = os.path.join(directorio, f"salida_{tamano}{extension}")
+            shutil.copyfile(plantilla_base, plantilla)
+            corridas.append(_run_in_fresh_process(origen, plantilla, motor, filas_por_bloque))
+        rss = [c["rss_max_mb"] for c in corridas if c["rss_max_mb"] is not None]
+        resultados[str(tamano)] = {
+            "filas_origen": corridas[0]["filas_origen"],
+            "filas_escritas": corridas[0]["filas_escritas"],
+            "tiempos": {fase: min(c["tiempos"].get(fase, 0.0) for c in corridas) for fase in FASES},
+            "rss_max_mb": max(rss) if rss else None,
+        }
+        resultados[str(tamano)]["total"] = sum(resultados[str(tamano)]["tiempos"].values())
+    return resultados
+
+
+def compare(resultados, baseline, tolerancia):
+    """Devuelve la lista de regresiones: (tamaño, fase, segundos_base, segundos_actuales)."""
+    regresiones = []
+    for tamano, actual in resultados.items():
+        base = baseline.get(tamano)
+        if not base:
+            continue
+        for fase in FASES + ["total"]:
+            segundos_base = base["tiempos"].get(fase) if fase != "total" else base.get("total")
+            segundos = actual["tiempos"][fase] if fase != "total" else actual["total"]
+            if segundos_base is None or max(segundos, segundos_base) < SEGUNDOS_MINIMOS_COMPARACION:
+                continue
+            if segundos > segundos_base * (1 + tolerancia):
+                regresiones.append((tamano, fase, segundos_base, segundos))
+    return regresiones
+
+
+def print_table(resultados, baseline):
+    encabezado = f"{'filas':>8} " + " ".join(f"{fase:>11}" for fase in FASES) + f" {'total':>9} {'RSS MB':>8}"
+    print(encabezado)
+    print("-" * len(encabezado))
+    for tamano, actual in resultados.items():
+        celdas = " ".join(f"{actual['tiempos'][fase]:>10.3f}s" for fase in FASES)
+        rss = f"{actual['rss_max_mb']:>8.0f}" if actual["rss_max_mb"] is not None else f"{'-':>8}"
+        print(f"{tamano:>8} {celdas} {actual['total']:>8.3f}s {rss}")
+        base = baseline.get(tamano)
+        if base:
+            celdas = " ".join(f"{base['tiempos'].get(fase, 0.0):>10.3f}s" for fase in FASES)
+            print(f"{'(base)':>8} {celdas} {base.get('total', 0.0):>8.3f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el rendimiento del procesamiento con datos sintéticos.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS_POR_DEFECTO,
+                        help="Número de filas de los libros de origen a medir.")
+    parser.add_argument("--motor", default="openpyxl", help="Motor de escritura (openpyxl o xlwings).")
+    parser.add_argument("--filas-por-bloque", type=int, default=10000,
+                        help="Filas que se escriben por bloque; 0 = toda la hoja de una vez.")
+    parser.add_argument("--datos", default=DATOS_POR_DEFECTO,
+                        help="Carpeta donde se generan (y reutilizan) los libros sintéticos.")
+    parser.add_argument("--repeticiones", type=int, default=1,
+                        help="Corridas por tamaño; se toma el menor tiempo de cada fase.")
+    parser.add_argument("--baseline", default=BASELINE_POR_DEFECTO, help="Archivo JSON con la línea base.")
+    parser.add_argument("--guardar-baseline", action="store_true",
+                        help="Guarda el resultado como nueva línea base en lugar de compararlo.")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_POR_DEFECTO,
+                        help="Aumento relativo permitido antes de considerar una regresión (0.2 = 20%%).")
+    parser.add_argument("--json", help="Guarda también el resultado completo en este archivo.")
+    args = parser.parse_args(argv)
+    if args.filas_por_bloque < 0:
+        parser.error("--filas-por-bloque no puede ser negativo")
+
+    resultados = run_benchmark(args.tamanos, args.motor, args.datos, max(1, args.repeticiones),
+                               args.filas_por_bloque or None)
+
+    baseline = {}
+    if not args.guardar_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get(args.motor, {})
+
+    print_table(resultados, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({args.motor: resultados}, f, indent=1)
+
+    if args.guardar_baseline:
+        guardado = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                guardado = json.load(f)
+        guardado.setdefault(args.motor, {}).update(resultados)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(guardado, f, indent=1)
+        print(f"Línea base guardada en {args.baseline}")
+        return 0
+
+    regresiones = compare(resultados, baseline, args.tolerancia)
+    for tamano, fase, segundos_base, segundos in regresiones:
+        print(f"REGRESIÓN: {tamano} filas, fase '{fase}': {segundos_base:.3f}s -> {segundos:.3f}s")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# benchmarks/generar_datos.py
+"""
+Generador de libros de origen sintéticos con la estructura de 'TABLA (OK)':
+títulos en las filas 1 a 6, encabezados en la fila 7 y datos a partir de la fila 8,
+con columnas adicionales que el procesador no usa y valores mezclados (EMISOR con
+espacios/minúsculas, tipos de documento excluidos, fechas como texto o serial de Excel, etc.).
+
+    python -m benchmarks.generar_datos salida.xlsx --filas 10000
+"""
+import argparse
+import datetime
+import os
+import shutil
+
+import numpy as np
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+HOJA_ORIGEN = "TABLA (OK)"
+FILA_ENCABEZADOS = 7
+
+ENCABEZADOS_ORIGEN = [
+    'FECHA DE EMISION', 'EMISOR', 'NOMBRE O RAZON SOCIAL', 'RFC', 'TIPO DE DOCUMENTO', 'CONCEPTO',
+    'FOLIO', 'UUID', 'CONTRATO', 'PERIODO \nDE \nRENTA', 'MONEDA', 'TOTAL', 'SALDO \nPENDIENTE',
+    'FECHA DE PAGO', 'AGENTE', 'OBSERVACIONES',
+]
+
+# Valores y pesos relativos de las columnas categóricas.
+EMISORES = {'OVL': 45, 'LFOV': 30, ' ovl ': 4, 'Lfov': 4, 'OTRA EMPRESA': 15, None: 2}
+TIPOS_DOCUMENTO = {'FACTURA': 60, 'NOTA DE CREDITO': 10, 'Saldo a favor': 5, 'RECIBO DE PAGO': 10,
+                   'CANCELADA': 10, 'ANTICIPO': 5}
+AGENTES = {'ELVIRA': 45, 'CARLOS': 45, ' elvira ': 3, 'SIN ASIGNAR': 4, None: 3}
+CONCEPTOS = ['RENTA MENSUAL', 'MANTENIMIENTO', 'SERVICIOS', 'PENALIZACION']
+MESES = ['ENE', 'FEB', 'MAR', 'ABR', 'MAY', 'JUN', 'JUL', 'AGO', 'SEP', 'OCT', 'NOV', 'DIC']
+
+ENCABEZADOS_PLANTILLA = [
+    'EMISOR', 'NOMBRE O RAZON SOCIAL', 'TIPO DE DOCUMENTO', 'CONCEPTO', 'FOLIO', 'CONTRATO',
+    'PERIODO DE RENTA', 'SALDO PENDIENTE', 'FECHA DE PAGO', 'AGENTE', 'SALDO TOTAL',
+    'PRONOSTICO DE COBRANZA', 'ESTADO DE PRONOSTICO', 'X - CONFIRMADO O- POR CONFIRMAR',
+]
+HOJAS_PLANTILLA = ["FACTURACION OVL", "FACTURACION LFOV"]
+PLANTILLA_REAL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "LAYOUT_PRONOSTICO_COBRANZA.xlsm")
+
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+
+def _elegir(rng, opciones, n):
+    valores = list(opciones)
+    pesos = np.array(list(opciones.values()), dtype=float)
+    return [valores[i] for i in rng.choice(len(valores), size=n, p=pesos / pesos.sum())]
+
+
+def generate_origin(path, filas, seed=0):
+    """Escribe un libro de origen sintético con 'filas' filas de datos."""
+    if openpyxl is None:
+        raise ImportError("La librería openpyxl no está instalada. Instálela con: pip install openpyxl")
+    rng = np.random.default_rng(seed)
+    num_clientes = max(10, filas // 20)
+
+    emisores = _elegir(rng, EMISORES, filas)
+    tipos = _elegir(rng, TIPOS_DOCUMENTO, filas)
+    agentes = _elegir(rng, AGENTES, filas)
+    clientes = rng.integers(0, num_clientes, size=filas)
+    contratos = rng.integers(1, num_clientes * 2, size=filas)
+    totales = np.round(rng.uniform(500, 250000, size=filas), 2)
+    saldos = np.round(totales * rng.uniform(0, 1, size=filas), 2)
+    dias_pago = rng.integers(0, 730, size=filas)
+    formato_fecha = rng.choice(4, size=filas, p=[0.7, 0.1, 0.1, 0.1])
+    saldo_texto = rng.random(filas) < 0.02
+    inicio = datetime.datetime(2024, 1, 1)
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(HOJA_ORIGEN)
+    ws.append(["REPORTE DE FACTURACION"])
+    ws.append([f"Generado: {datetime.date.today():%d/%m/%Y}"])
+    for _ in range(FILA_ENCABEZADOS - 3):
+        ws.append([])
+    ws.append(ENCABEZADOS_ORIGEN)
+
+    for i in range(filas):
+        fecha_pago = inicio + datetime.timedelta(days=int(dias_pago[i]))
+        if formato_fecha[i] == 1:
+            fecha_pago = fecha_pago.strftime("%d/%m/%Y")
+        elif formato_fecha[i] == 2:
+            fecha_pago = (fecha_pago - EXCEL_EPOCH).days
+        elif formato_fecha[i] == 3:
+            fecha_pago = None
+        ws.append([
+            inicio + datetime.timedelta(days=int(dias_pago[i]) // 2),
+            emisores[i],
+            f"CLIENTE {int(clientes[i]):05d} S.A. DE C.V.",
+            f"XAX{int(clientes[i]):06d}000",
+            tipos[i],
+            CONCEPTOS[i % len(CONCEPTOS)],
+            100000 + i,
+            f"{i:08X}-0000-4000-8000-{int(clientes[i]):012X}",
+            f"CT-{int(contratos[i]):05d}",
+            f"{MESES[i % 12]}-{24 + (i // 12) % 2}",
+            'MXN',
+            float(totales[i]),
+            '-' if saldo_texto[i] else float(saldos[i]),
+            fecha_pago,
+            agentes[i],
+            None if i % 7 else "Revisar con el cliente",
+        ])
+    wb.save(path)
+    return path
+
+
+def generate_template(path):
+    """
+    Crea una plantilla de destino. Si existe LAYOUT_PRONOSTICO_COBRANZA.xlsm se copia;
+    si no, se genera un libro con las mismas hojas y encabezados (sin macros).
+    """
+    if os.path.exists(PLANTILLA_REAL) and path.lower().endswith(".xlsm"):
+        shutil.copyfile(PLANTILLA_REAL, path)
+        return path
+    if openpyxl is None:
+        raise ImportError("La librería openpyxl no está instalada. Instálela con: pip install openpyxl")
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for hoja in HOJAS_PLANTILLA:
+        ws = wb.create_sheet(hoja)
+        ws.append(ENCABEZADOS_PLANTILLA)
+    wb.save(path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un libro de origen sintético ('TABLA (OK)').")
+    parser.add_argument("salida", help="Ruta del archivo .xlsx a generar.")
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate_origin(args.salida, args.filas, args.semilla)
+
+
+if __name__ == "__main__":
+    main()
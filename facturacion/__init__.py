@@ -0,0 +1,4 @@
+# facturacion/__init__.py
+"""
+Paquete de soporte del Procesador de Pronóstico de Cobranza.
+"""
@@ -0,0 +1,7 @@
+# facturacion/__main__.py
+import sys
+
+from facturacion.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# facturacion/batch.py
+"""
+Procesamiento por lotes: la lectura y el filtrado de cada archivo de origen se reparten
+entre varios procesos (ProcessPoolExecutor); la escritura de las plantillas se hace en
+el proceso principal, de una en una, con un único motor de escritura.
+
+Con un caché (facturacion.cache.ResultCache) se omite la lectura de los orígenes que no
+cambiaron y la escritura de las plantillas que ya contienen ese resultado.
+
+Si el procesador tiene un reporte de tiempos (processor.report), cada resultado incluye
+las fases medidas de la preparación y de la escritura ('fases').
+"""
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from facturacion.processor import FacturacionProcessor, FacturacionError
+from facturacion.tracing import RunReport
+
+
+# Procesador y caché de cada proceso de trabajo (se reciben una sola vez por proceso).
+_processor_worker = None
+_cache_worker = None
+
+
+def _init_worker(processor, cache=None):
+    global _processor_worker, _cache_worker
+    _processor_worker = processor
+    _cache_worker = cache
+
+
+def _prepare_origin(origin_path):
+    """
+    Lectura, filtrado e intercalado de un archivo de origen. Se ejecuta en un proceso de
+    trabajo, por eso devuelve los errores como datos en lugar de lanzar excepciones.
+    """
+    inicio = time.perf_counter()
+    resultado = {"origen": origin_path, "pid": os.getpid(), "error": None, "tipo_error": None,
+                 "clave": None, "cache": None, "fases": None}
+    if _processor_worker.report is not None:
+        # Un reporte nuevo por archivo; sus fases viajan con el resultado.
+        _processor_worker.report = RunReport()
+        resultado["fases"] = {"preparacion": _processor_worker.report.spans}
+    try:
+        if not os.path.isfile(origin_path):
+            raise FileNotFoundError(f"El archivo de origen no existe: {origin_path}")
+        guardado = None
+        if _cache_worker is not None:
+            resultado["clave"] = _cache_worker.key_for(origin_path, _processor_worker)
+            guardado = _cache_worker.load(resultado["clave"])
+        if guardado is not None:
+            resultado["cache"] = "acierto"
+            resultado["hojas"], resultado["advertencias"] = guardado
+        else:
+            advertencias = []
+            resultado["hojas"] = _processor_worker.prepare(origin_path, advertencias)
+            resultado["advertencias"] = advertencias
+            if _cache_worker is not None:
+                resultado["cache"] = "fallo"
+                _cache_worker.store(resultado["clave"], (resultado["hojas"], advertencias))
+    except FacturacionError as e:
+        resultado["error"], resultado["tipo_error"] = e.mensaje, e.titulo
+    except Exception as e:
+        resultado["error"], resultado["tipo_error"] = str(e), type(e).__name__
+    resultado["segundos_preparacion"] = time.perf_counter() - inicio
+    return resultado
+
+
+def default_workers(num_archivos):
+    return max(1, min(num_archivos, os.cpu_count() or 1))
+
+
+def duplicate_destinations(jobs):
+    """Destinos que comparten dos o más trabajos (comparados como rutas absolutas normalizadas)."""
+    vistos = {}
+    for _, destino in jobs:
+        clave = os.path.normcase(os.path.abspath(destino))
+        vistos[clave] = vistos.get(clave, 0) + 1
+    return sorted({destino for _, destino in jobs if vistos[os.path.normcase(os.path.abspath(destino))] > 1})
+
+
+def run_batch(jobs, writer, processor=None, workers=None, template_path=None, cache=None):
+    """
+    Procesa una lista de trabajos (origen, destino) y devuelve un generador con el
+    resultado de cada archivo, en el orden en que terminan.
+
+    Si se indica template_path y el destino es distinto, la plantilla se copia al
+    destino justo antes de escribirlo. Con workers=1 todo se ejecuta en este proceso.
+    Con cache, el resultado indica si hubo acierto ('cache') y si se omitió la escritura
+    porque el destino ya estaba al día ('escritura_omitida').
+
+    Lanza ValueError antes de procesar nada si dos trabajos comparten destino.
+    """
+    repetidos = duplicate_destinations(jobs)
+    if repetidos:
+        raise ValueError(f"Varios orígenes escribirían el mismo destino: {', '.join(repetidos)}")
+    processor = processor or FacturacionProcessor()
+    destinos = dict(jobs)
+    workers = workers or default_workers(len(jobs))
+
+    def escribir(resultado):
+        resultado["destino"] = destinos[resultado["origen"]]
+        resultado["segundos_escritura"] = 0.0
+        resultado["escritura_omitida"] = False
+        if resultado["error"] is None:
+            inicio = time.perf_counter()
+            if processor.report is not None:
+                processor.report = RunReport()
+                resultado["fases"] = {**(resultado["fases"] or {}), "escritura": processor.report.spans}
+            try:
+                destino = resultado["destino"]
+                plantilla = template_path or destino
+                hojas = resultado.pop("hojas")
+                resultado["filas"] = {hoja: len(df_hoja) for hoja, df_hoja in hojas.items()}
+                # Lo escrito depende también de la configuración de escritura (p. ej. la fecha del resumen).
+                clave_escritura = f"{resultado['clave']}|{processor.write_fingerprint()}"
+                if cache is not None and cache.write_is_current(clave_escritura, destino, plantilla):
+                    resultado["escritura_omitida"] = True
+                else:
+                    if plantilla != destino:
+                        shutil.copyfile(plantilla, destino)
+                    resultado["cambios"] = processor.write_template(writer, destino, hojas)
+                    if cache is not None:
+                        cache.mark_written(clave_escritura, destino, plantilla)
+            except FacturacionError as e:
+                resultado["error"], resultado["tipo_error"] = e.mensaje, e.titulo
+            except Exception as e:
+                resultado["error"], resultado["tipo_error"] = str(e), type(e).__name__
+            resultado["segundos_escritura"] = time.perf_counter() - inicio
+        resultado.pop("hojas", None)
+        return resultado
+
+    if workers <= 1:
+        _init_worker(processor, cache)
+        for origen, _ in jobs:
+            yield escribir(_prepare_origin(origen))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(processor, cache)) as pool:
+        futuros = [pool.submit(_prepare_origin, origen) for origen, _ in jobs]
+        # Las plantillas se escriben en serie a medida que terminan las lecturas.
+        for futuro in as_completed(futuros):
+            yield escribir(futuro.result())
@@ -0,0 +1,160 @@
+# facturacion/cache.py
+"""
+Caché local en disco para no volver a procesar archivos de origen que no cambiaron.
+
+- Resultados: las hojas procesadas (una por ruta) se guardan en formato pickle, con una
+  clave formada por el hash del contenido del archivo de origen y la configuración del
+  procesador. Si el caché supera su tamaño máximo se borran los menos usados (LRU).
+- Escrituras: por cada plantilla escrita se recuerda qué origen se usó y el hash del
+  archivo resultante, para omitir la escritura si ni el origen ni la plantilla cambiaron.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+
+# Cambiar este número si cambia la lógica de procesamiento, para invalidar el caché anterior.
+VERSION_CACHE = 4
+
+TAMANO_MAXIMO_POR_DEFECTO = 512 * 1024 * 1024  # 512 MB
+
+EXTENSION_RESULTADO = ".pkl"
+ARCHIVO_ESCRITURAS = "escrituras.json"
+
+
+def default_cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "facturacion")
+
+
+def file_hash(path, bloque=1024 * 1024):
+    """Hash SHA-256 del contenido de un archivo."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for trozo in iter(lambda: f.read(bloque), b""):
+            sha.update(trozo)
+    return sha.hexdigest()
+
+
+def config_fingerprint(processor):
+    """Hash de la configuración del procesador que afecta al resultado."""
+    config = {
+        "version": VERSION_CACHE,
+        "hoja_origen": processor.HOJA_ORIGEN,
+        "fila_encabezados": processor.FILA_INICIO_ENCABEZADOS_ORIGEN,
+        # Emisores, hojas, tipos de documento, columnas, agentes y colores de cada ruta.
+        "rutas": [{**ruta, "columnas": list(ruta["columnas"].items())} for ruta in processor.routes()],
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path, escribir, modo="wb"):
+    """Escribe en un archivo temporal y lo renombra, para no dejar archivos a medias."""
+    directorio = os.path.dirname(path)
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(fd, modo) as f:
+            escribir(f)
+        os.replace(temporal, path)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+class ResultCache:
+    def __init__(self, directorio=None, max_bytes=TAMANO_MAXIMO_POR_DEFECTO):
+        self.directorio = directorio or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directorio, exist_ok=True)
+
+    # --- Resultados procesados ---
+
+    def key_for(self, origin_path, processor):
+        return hashlib.sha256((file_hash(origin_path) + config_fingerprint(processor)).encode("ascii")).hexdigest()
+
+    def _result_path(self, clave):
+        return os.path.join(self.directorio, clave + EXTENSION_RESULTADO)
+
+    def load(self, clave):
+        """
+        Devuelve las hojas guardadas para la clave, o None si no están en caché. Una entrada
+        que no se puede leer (dañada, o guardada con otra versión de pandas) se borra, para
+        que el origen se vuelva a procesar.
+        """
+        ruta = self._result_path(clave)
+        try:
+            with open(ruta, "rb") as f:
+                hojas = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+            return None
+        # Marcar como usado recientemente (para el LRU).
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        return hojas
+
+    def store(self, clave, hojas):
+        _atomic_write(self._result_path(clave), lambda f: pickle.dump(hojas, f, protocol=pickle.HIGHEST_PROTOCOL))
+        self.evict()
+
+    def evict(self):
+        """Borra los resultados menos usados hasta quedar por debajo del tamaño máximo."""
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith(EXTENSION_RESULTADO):
+                try:
+                    info = os.stat(os.path.join(self.directorio, nombre))
+                except OSError:
+                    continue
+                entradas.append((info.st_mtime, info.st_size, nombre))
+        total = sum(tamano for _, tamano, _ in entradas)
+        for _, tamano, nombre in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+                total -= tamano
+            except OSError:
+                pass
+
+    # --- Escrituras de plantillas ---
+
+    def _load_writes(self):
+        try:
+            with open(os.path.join(self.directorio, ARCHIVO_ESCRITURAS), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_is_current(self, clave, destino, plantilla):
+        """
+        True si 'destino' ya contiene el resultado de la clave de origen indicada: no se
+        modificó desde la última escritura y se generó a partir de la misma plantilla.
+        """
+        registro = self._load_writes().get(os.path.abspath(destino))
+        if not registro or registro["origen"] != clave or not os.path.isfile(destino):
+            return False
+        if file_hash(destino) != registro["destino"]:
+            return False
+        return plantilla == destino or file_hash(plantilla) == registro["plantilla"]
+
+    def mark_written(self, clave, destino, plantilla):
+        escrituras = self._load_writes()
+        hash_destino = file_hash(destino)
+        escrituras[os.path.abspath(destino)] = {
+            "origen": clave,
+            "destino": hash_destino,
+            "plantilla": hash_destino if plantilla == destino else file_hash(plantilla),
+        }
+        _atomic_write(os.path.join(self.directorio, ARCHIVO_ESCRITURAS),
+                      lambda f: json.dump(escrituras, f, indent=1), modo="w")
@@ -0,0 +1,319 @@
+# facturacion/cli.py
+"""
+Línea de comandos del Procesador de Pronóstico de Cobranza (sin interfaz gráfica).
+
+Ejemplos:
+    python -m facturacion origen.xlsx -p LAYOUT_PRONOSTICO_COBRANZA.xlsm
+    python -m facturacion "exportaciones/*.xlsx" -p LAYOUT_PRONOSTICO_COBRANZA.xlsm -o salida/
+
+Con un solo archivo de origen y sin --salida se actualiza la plantilla indicada
+(igual que la aplicación de escritorio). Con --salida, cada origen genera una copia
+de la plantilla en ese directorio; los orígenes de subcarpetas distintas llevan la
+subcarpeta en el nombre (sucursal1/export.xlsx -> sucursal1_export_<plantilla>).
+
+La lectura y el filtrado de varios orígenes se reparten entre procesos (--procesos);
+las plantillas se escriben de una en una.
+
+Con --vigilar, los orígenes son carpetas: se procesa cada archivo nuevo o modificado que
+aparezca en ellas, hasta interrumpir con Ctrl+C (ver facturacion.watcher).
+
+Con --rutas se indica qué EMISOR va a cada hoja de la plantilla, por ejemplo:
+    [{"emisores": ["OVL"], "hoja": "FACTURACION OVL"},
+     {"emisores": ["LFOV"], "hoja": "FACTURACION LFOV"},
+     {"emisores": ["OTRA EMPRESA"], "hoja": "FACTURACION OTRA", "nombre": "OTRA",
+      "colores": {"ELVIRA": [102, 255, 255], "CARLOS": [204, 255, 153]}}]
+Todas las hojas se escriben con una sola apertura y un solo guardado de la plantilla.
+
+Con --reporte se guarda un JSON con el tiempo, las filas y la variación de memoria de
+cada fase (lectura, filtros, intercalado, escritura, colores, formato, guardado...).
+Con --perfil se ejecuta todo en un solo proceso bajo cProfile o pyinstrument.
+
+Códigos de salida: 0 = todo correcto, 1 = algún archivo falló, 2 = uso incorrecto.
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import logging
+import os
+import sys
+import time
+
+from facturacion.batch import run_batch, default_workers, duplicate_destinations
+from facturacion.cache import ResultCache, default_cache_dir, TAMANO_MAXIMO_POR_DEFECTO
+from facturacion.processor import FacturacionError, FacturacionProcessor, MODO_COMPLETO, MODO_DIFERENCIAL
+from facturacion.watcher import watch, EXTENSIONES_ORIGEN, INTERVALO_POR_DEFECTO, ESPERA_POR_DEFECTO
+from facturacion.tracing import RunReport, profiled, profiler_available, PERFILADORES
+from facturacion.writers import create_writer, MOTOR_POR_DEFECTO, WRITERS
+
+
+EXIT_OK = 0
+EXIT_ERRORES = 1
+EXIT_USO = 2
+
+logger = logging.getLogger("facturacion")
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON (evento + campos adicionales)."""
+    CAMPOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        evento = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "mensaje": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in self.CAMPOS_ESTANDAR:
+                evento[clave] = valor
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+def configure_logging(log_path=None, nivel=logging.INFO):
+    handler = logging.FileHandler(log_path, encoding="utf-8") if log_path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    raiz = logging.getLogger("facturacion")
+    raiz.handlers[:] = [handler]
+    raiz.setLevel(nivel)
+    raiz.propagate = False
+
+
+def expand_origins(patrones, excluir=()):
+    """
+    Expande archivos, directorios y patrones glob a una lista ordenada de archivos
+    de origen (.xlsx/.xlsm), sin duplicados y sin archivos temporales de Excel (~$).
+    Los archivos de 'excluir' (p. ej. la plantilla) no se toman de directorios ni patrones.
+    """
+    excluidos = {os.path.normcase(os.path.abspath(ruta)) for ruta in excluir}
+    rutas = []
+    for patron in patrones:
+        if os.path.isdir(patron):
+            candidatos = [os.path.join(patron, nombre) for nombre in os.listdir(patron)]
+        else:
+            candidatos = glob.glob(patron) or [patron]
+        for ruta in sorted(candidatos):
+            nombre = os.path.basename(ruta)
+            if os.path.isdir(ruta) or nombre.startswith("~$"):
+                continue
+            if os.path.isdir(patron) and not nombre.lower().endswith(EXTENSIONES_ORIGEN):
+                continue
+            if ruta != patron and os.path.normcase(os.path.abspath(ruta)) in excluidos:
+                continue
+            if ruta not in rutas:
+                rutas.append(ruta)
+    return rutas
+
+
+def common_dir(carpetas):
+    """Carpeta común a todas las carpetas, o None si no la hay (p. ej. unidades distintas en Windows)."""
+    try:
+        return os.path.commonpath([os.path.abspath(carpeta) for carpeta in carpetas])
+    except ValueError:
+        return None
+
+
+def output_path_for(origin_path, template_path, output_dir, base_dir=None):
+    """
+    Ruta de la copia de la plantilla para un origen: <salida>/<origen>_<plantilla>.
+    Con base_dir, <origen> es la ruta relativa a esa carpeta con '_' en lugar de los
+    separadores (sucursal1/export.xlsx -> sucursal1_export), para que dos orígenes con el
+    mismo nombre en carpetas distintas no compartan destino.
+    """
+    nombre_origen = os.path.basename(origin_path)
+    if base_dir is not None:
+        try:
+            nombre_origen = os.path.relpath(os.path.abspath(origin_path), base_dir)
+        except ValueError:
+            pass
+    stem_origen = os.path.splitext(nombre_origen)[0].replace(os.sep, "_")
+    if os.altsep:
+        stem_origen = stem_origen.replace(os.altsep, "_")
+    return os.path.join(output_dir, f"{stem_origen}_{os.path.basename(template_path)}")
+
+
+def open_writer(motor):
+    """Crea el motor de escritura, o registra el error y devuelve None (motor desconocido o no instalado)."""
+    try:
+        return create_writer(motor)
+    except (ImportError, ValueError) as e:
+        logger.error("No se pudo crear el motor de escritura.", extra={"evento": "motor_error", "motor": motor, "detalle": str(e)})
+        return None
+
+
+def log_result(resultado):
+    """Registra el resultado de un archivo (ver facturacion.batch.run_batch). Devuelve True si no hubo error."""
+    tiempos = {"segundos_preparacion": round(resultado["segundos_preparacion"], 3),
+               "segundos_escritura": round(resultado["segundos_escritura"], 3)}
+    if "segundos_desde_cambio" in resultado:
+        tiempos["segundos_desde_cambio"] = resultado["segundos_desde_cambio"]
+    if resultado["error"] is None:
+        logger.info("Archivo procesado.", extra={
+            "evento": "archivo_procesado", "origen": resultado["origen"], "destino": resultado["destino"],
+            "filas": resultado["filas"], "advertencias": [mensaje for _, mensaje in resultado["advertencias"]],
+            "cambios": resultado.get("cambios") or None, "cache": resultado["cache"],
+            "escritura_omitida": resultado["escritura_omitida"], "pid": resultado["pid"], **tiempos})
+        return True
+    logger.error(resultado["error"], extra={
+        "evento": "archivo_error", "origen": resultado["origen"], "tipo": resultado["tipo_error"], **tiempos})
+    return False
+
+
+def non_negative_int(texto):
+    """Tipo de argparse: entero mayor o igual a cero."""
+    try:
+        valor = int(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"se esperaba un número entero: '{texto}'")
+    if valor < 0:
+        raise argparse.ArgumentTypeError(f"no puede ser negativo: {valor}")
+    return valor
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m facturacion",
+        description="Procesa archivos de origen (hoja 'TABLA (OK)') y actualiza la plantilla de Pronóstico de Cobranza.")
+    parser.add_argument("origenes", nargs="+",
+                        help="Archivos de origen, directorios o patrones glob (p. ej. 'exportaciones/*.xlsx').")
+    parser.add_argument("-p", "--plantilla", required=True, help="Archivo de plantilla de destino (.xlsm).")
+    parser.add_argument("-o", "--salida",
+                        help="Directorio de salida. Si se omite, se sobrescribe la plantilla (sólo con un origen).")
+    parser.add_argument("--motor", choices=sorted(WRITERS), default=MOTOR_POR_DEFECTO,
+                        help=f"Motor de escritura de la plantilla (por defecto: {MOTOR_POR_DEFECTO}).")
+    parser.add_argument("--diferencial", action="store_true",
+                        help="Sólo escribir las filas que cambiaron respecto al contenido actual de la plantilla.")
+    parser.add_argument("--rutas",
+                        help="Archivo JSON con las rutas EMISOR -> hoja (emisores, hoja y, opcionalmente, nombre, "
+                             "tipos_documento, columnas, agentes y colores). Por defecto: OVL y LFOV.")
+    parser.add_argument("--sin-resumen", action="store_true",
+                        help="No escribir la hoja de resumen de cobranza (totales por agente, cliente, contrato y antigüedad).")
+    parser.add_argument("--fecha-corte", type=datetime.date.fromisoformat,
+                        help="Fecha de referencia (AAAA-MM-DD) para la antigüedad del resumen (por defecto: hoy).")
+    parser.add_argument("--filas-por-bloque", type=non_negative_int, default=10000,
+                        help="Filas que se escriben por bloque; 0 = toda la hoja de una vez (por defecto: %(default)s).")
+    parser.add_argument("--cache", default=default_cache_dir(),
+                        help="Directorio del caché de resultados (por defecto: %(default)s).")
+    parser.add_argument("--cache-max-mb", type=int, default=TAMANO_MAXIMO_POR_DEFECTO // (1024 * 1024),
+                        help="Tamaño máximo del caché en MB (por defecto: %(default)s).")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="No usar el caché: siempre leer los orígenes y escribir las plantillas.")
+    parser.add_argument("--procesos", type=int,
+                        help="Procesos para leer y filtrar los orígenes en paralelo "
+                             "(por defecto: uno por núcleo, sin superar el número de archivos).")
+    parser.add_argument("--vigilar", action="store_true",
+                        help="Vigilar las carpetas indicadas y procesar cada archivo nuevo o modificado (Ctrl+C para terminar).")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO_POR_DEFECTO,
+                        help="Con --vigilar: segundos entre revisiones de las carpetas (por defecto: %(default)s).")
+    parser.add_argument("--espera", type=float, default=ESPERA_POR_DEFECTO,
+                        help="Con --vigilar: segundos sin cambios antes de procesar un archivo (por defecto: %(default)s).")
+    parser.add_argument("--incluir-existentes", action="store_true",
+                        help="Con --vigilar: procesar también los archivos que ya estaban en las carpetas al iniciar.")
+    parser.add_argument("--log", help="Archivo donde escribir el registro JSON (por defecto: stderr).")
+    parser.add_argument("--reporte", help="Archivo JSON donde guardar el tiempo, filas y memoria de cada fase.")
+    parser.add_argument("--perfil",
+                        help="Archivo donde guardar el perfil de la ejecución (.prof con cProfile; .html o .txt con "
+                             "pyinstrument). Implica --procesos 1.")
+    parser.add_argument("--perfilador", choices=PERFILADORES, default="cprofile",
+                        help="Perfilador a usar con --perfil (por defecto: %(default)s).")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(args.log)
+
+    if args.vigilar:
+        origenes = args.origenes
+        no_carpetas = [carpeta for carpeta in origenes if not os.path.isdir(carpeta)]
+        if no_carpetas:
+            logger.error("Con --vigilar los orígenes deben ser carpetas.", extra={"evento": "uso_incorrecto", "origenes": no_carpetas})
+            return EXIT_USO
+    else:
+        origenes = expand_origins(args.origenes, excluir=[args.plantilla])
+    if not origenes:
+        logger.error("No se encontraron archivos de origen.", extra={"evento": "sin_origenes", "patrones": args.origenes})
+        return EXIT_USO
+    if not os.path.isfile(args.plantilla):
+        logger.error("El archivo de plantilla no existe.", extra={"evento": "plantilla_inexistente", "plantilla": args.plantilla})
+        return EXIT_USO
+    if len(origenes) > 1 and not args.salida and not args.vigilar:
+        logger.error("Con varios archivos de origen debe indicarse --salida.", extra={"evento": "uso_incorrecto", "origenes": len(origenes)})
+        return EXIT_USO
+    if args.perfil and not profiler_available(args.perfilador):
+        logger.error("El perfilador indicado no está instalado.", extra={"evento": "uso_incorrecto", "perfilador": args.perfilador})
+        return EXIT_USO
+    if args.salida:
+        os.makedirs(args.salida, exist_ok=True)
+
+    processor = FacturacionProcessor()
+    processor.MODO_ACTUALIZACION = MODO_DIFERENCIAL if args.diferencial else MODO_COMPLETO
+    processor.FILAS_POR_BLOQUE = args.filas_por_bloque or None
+    if args.sin_resumen:
+        processor.HOJA_RESUMEN = None
+    processor.FECHA_CORTE = args.fecha_corte
+    if args.rutas:
+        try:
+            processor.load_routes(args.rutas)
+        except FacturacionError as e:
+            logger.error("Configuración de rutas no válida.", extra={"evento": "uso_incorrecto", "rutas": args.rutas, "detalle": e.mensaje})
+            return EXIT_USO
+    cache = None if args.sin_cache else ResultCache(args.cache, args.cache_max_mb * 1024 * 1024)
+
+    if args.vigilar:
+        base_dir = common_dir(origenes)
+
+        def destino_para(origen):
+            return output_path_for(origen, args.plantilla, args.salida, base_dir) if args.salida else args.plantilla
+
+        # Un único motor, iniciado una vez y reutilizado para todos los archivos que lleguen;
+        # el hilo de vigilancia lo inicia y lo cierra.
+        writer = open_writer(args.motor)
+        if writer is None:
+            return EXIT_USO
+        iniciado = watch(origenes, writer, processor, destino_para, template_path=args.plantilla, cache=cache,
+                         on_result=log_result, intervalo=args.intervalo, espera=args.espera,
+                         incluir_existentes=args.incluir_existentes, carpeta_salida=args.salida)
+        return EXIT_OK if iniciado else EXIT_ERRORES
+
+    base_dir = common_dir([os.path.dirname(origen) or os.curdir for origen in origenes])
+    jobs = [(origen, output_path_for(origen, args.plantilla, args.salida, base_dir) if args.salida else args.plantilla)
+            for origen in origenes]
+    repetidos = duplicate_destinations(jobs)
+    if repetidos:
+        logger.error("Varios orígenes escribirían el mismo destino.", extra={"evento": "uso_incorrecto", "destinos": repetidos})
+        return EXIT_USO
+    writer = open_writer(args.motor)
+    if writer is None:
+        return EXIT_USO
+    # Con --perfil todo corre en este proceso, para que el perfil incluya la lectura.
+    workers = 1 if args.perfil else args.procesos or default_workers(len(jobs))
+    if args.reporte:
+        processor.report = RunReport()
+    archivos_reporte = []
+    errores = 0
+    inicio_total = time.perf_counter()
+
+    # Un único motor de escritura (y una única instancia de Excel con xlwings) para todos los archivos.
+    with contextlib.ExitStack() as pila:
+        if args.perfil:
+            pila.enter_context(profiled(args.perfil, args.perfilador))
+        pila.enter_context(writer)
+        for resultado in run_batch(jobs, writer, processor, workers, template_path=args.plantilla, cache=cache):
+            archivos_reporte.append({campo: resultado.get(campo) for campo in (
+                "origen", "destino", "filas", "cache", "escritura_omitida", "error", "segundos_preparacion",
+                "segundos_escritura", "fases")})
+            if not log_result(resultado):
+                errores += 1
+
+    logger.info("Lote terminado.", extra={
+        "evento": "lote_terminado", "archivos": len(jobs), "errores": errores, "procesos": workers,
+        "segundos": round(time.perf_counter() - inicio_total, 3)})
+
+    if args.reporte:
+        with open(args.reporte, "w", encoding="utf-8") as f:
+            json.dump({"motor": args.motor, "modo": processor.MODO_ACTUALIZACION, "procesos": workers,
+                       "segundos": round(time.perf_counter() - inicio_total, 6), "archivos": archivos_reporte},
+                      f, ensure_ascii=False, indent=1, default=str)
+    return EXIT_ERRORES if errores else EXIT_OK
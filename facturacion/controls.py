@@ -0,0 +1,284 @@
+# facturacion/controls.py
+"""
+Conservación de los controles de formulario (botones con macros) al guardar con openpyxl.
+
+openpyxl no lee los dibujos ni los controles de las hojas: al guardar, se pierden las partes
+<drawing> y <controls> que enlazan cada botón con su macro (p. ej. AplicarBordesOVL) y sólo
+queda el dibujo VML heredado. Antes de abrir el libro se copian del paquete original esos
+fragmentos de cada hoja junto con sus relaciones y partes; después de guardar se vuelven a
+insertar en el XML de la hoja, sin reinterpretarlos.
+
+Lo mismo ocurre con algunas partes del libro que openpyxl no conoce, como la lista de
+personas de los comentarios encadenados (xl/persons/person.xml): se copian tal cual y se
+vuelven a enlazar desde workbook.xml.rels en la misma reescritura del paquete.
+"""
+import os
+import posixpath
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_TIPOS = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+# Relaciones de la hoja que acompañan a los controles.
+TIPOS_RELACION = {f"{NS_REL}/drawing", f"{NS_REL}/vmlDrawing", f"{NS_REL}/ctrlProp"}
+RELACION_COMENTARIOS = f"{NS_REL}/comments"
+# Relaciones del libro que openpyxl descarta al guardar.
+TIPOS_RELACION_LIBRO = {"http://schemas.microsoft.com/office/2017/10/relationships/person"}
+LIBRO = "xl/workbook.xml"
+
+_DRAWING = re.compile(r"<drawing\b[^>]*/>")
+_LEGACY_DRAWING = re.compile(r"<legacyDrawing\b[^>]*/>")
+_CONTROLES = re.compile(r"<mc:AlternateContent\b[^>]*>\s*<mc:Choice\b[^>]*>\s*<controls>.*?</controls>\s*"
+                        r"</mc:Choice>\s*</mc:AlternateContent>|<controls>.*?</controls>", re.S)
+_ID_RELACION = re.compile(r'\br:id="([^"]+)"')
+_XMLNS = re.compile(r'\sxmlns:(\w+)="([^"]*)"')
+# Elementos que van después de <drawing>/<legacyDrawing>/<controls> en una hoja.
+_POSTERIORES = re.compile(r"<(?:legacyDrawingHF|drawingHF|picture|oleObjects|webPublishItems|tableParts|extLst)\b|</worksheet>")
+
+
+def _rels_path(parte):
+    carpeta, nombre = posixpath.split(parte)
+    return posixpath.join(carpeta, "_rels", f"{nombre}.rels")
+
+
+def _target(parte, destino):
+    """Ruta dentro del paquete de una relación (relativa a la parte, o absoluta con '/')."""
+    if destino.startswith("/"):
+        return destino[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(parte), destino))
+
+
+def _relations(zf, parte):
+    """{Id: (Type, parte destino)} de las relaciones de una parte."""
+    try:
+        raiz = ET.fromstring(zf.read(_rels_path(parte)))
+    except KeyError:
+        return {}
+    return {rel.get("Id"): (rel.get("Type"), _target(parte, rel.get("Target")))
+            for rel in raiz.iter(f"{{{NS_PKG_REL}}}Relationship") if rel.get("TargetMode") != "External"}
+
+
+def _sheet_parts(zf):
+    """{nombre de hoja: parte XML de la hoja} según workbook.xml."""
+    relaciones = _relations(zf, LIBRO)
+    hojas = {}
+    for hoja in ET.fromstring(zf.read(LIBRO)).iter(f"{{{NS_MAIN}}}sheet"):
+        rel = relaciones.get(hoja.get(f"{{{NS_REL}}}id"))
+        if rel is not None:
+            hojas[hoja.get("name")] = rel[1]
+    return hojas
+
+
+def _content_types(zf):
+    raiz = ET.fromstring(zf.read("[Content_Types].xml"))
+    overrides = {e.get("PartName").lstrip("/"): e.get("ContentType") for e in raiz.iter(f"{{{NS_TIPOS}}}Override")}
+    defaults = {e.get("Extension").lower(): e.get("ContentType") for e in raiz.iter(f"{{{NS_TIPOS}}}Default")}
+    return overrides, defaults
+
+
+def read_sheet_controls(path):
+    """
+    Lee del paquete los fragmentos de dibujo y controles de cada hoja, con sus relaciones
+    y partes. Devuelve {nombre de hoja: datos}; vacío si el libro no tiene controles.
+    """
+    controles = {}
+    with zipfile.ZipFile(path) as zf:
+        overrides, defaults = _content_types(zf)
+        for nombre, parte in _sheet_parts(zf).items():
+            try:
+                xml = zf.read(parte).decode("utf-8")
+            except KeyError:
+                continue
+            if "<controls>" not in xml and not _DRAWING.search(xml):
+                continue
+            fragmentos = [m.group(0) for patron in (_DRAWING, _LEGACY_DRAWING, _CONTROLES)
+                          for m in [patron.search(xml)] if m]
+            relaciones = _relations(zf, parte)
+            usadas = {rid: relaciones[rid] for rid in _ID_RELACION.findall("".join(fragmentos))
+                      if rid in relaciones and relaciones[rid][0] in TIPOS_RELACION}
+            partes = {}
+            pendientes = [destino for _, destino in usadas.values()]
+            while pendientes:
+                # Las partes de los controles y, un nivel más abajo, las de los dibujos (imágenes).
+                actual = pendientes.pop()
+                if actual in partes or actual not in zf.namelist():
+                    continue
+                partes[actual] = zf.read(actual)
+                if _rels_path(actual) in zf.namelist():
+                    partes[_rels_path(actual)] = zf.read(_rels_path(actual))
+                    pendientes += [destino for _, destino in _relations(zf, actual).values()]
+            raiz = xml[xml.index("<worksheet"):xml.index(">", xml.index("<worksheet"))]
+            controles[nombre] = {
+                "fragmentos": fragmentos,
+                "relaciones": usadas,
+                "partes": partes,
+                "tipos": {p: overrides[p] for p in partes if p in overrides},
+                "defaults": {p.rsplit(".", 1)[-1].lower(): defaults[p.rsplit(".", 1)[-1].lower()]
+                             for p in partes if p.rsplit(".", 1)[-1].lower() in defaults},
+                "xmlns": dict(_XMLNS.findall(raiz)),
+            }
+    return controles
+
+
+def read_workbook_parts(path):
+    """
+    Lee del paquete las partes del libro de TIPOS_RELACION_LIBRO (p. ej. xl/persons/person.xml)
+    con su relación desde workbook.xml. Devuelve vacío si el libro no tiene ninguna.
+    """
+    with zipfile.ZipFile(path) as zf:
+        overrides, _ = _content_types(zf)
+        usadas = {rid: (tipo, destino) for rid, (tipo, destino) in _relations(zf, LIBRO).items()
+                  if tipo in TIPOS_RELACION_LIBRO and destino in zf.namelist()}
+        if not usadas:
+            return {}
+        partes = {destino: zf.read(destino) for _, destino in usadas.values()}
+    return {"relaciones": usadas, "partes": partes,
+            "tipos": {p: overrides[p] for p in partes if p in overrides}}
+
+
+def _relationship_xml(rid, tipo, parte_hoja, destino):
+    destino_relativo = posixpath.relpath(destino, posixpath.dirname(parte_hoja))
+    return f'<Relationship Id="{rid}" Type="{tipo}" Target="{destino_relativo}"/>'
+
+
+def _restore_workbook_parts(contenido, nuevas, partes_libro):
+    """
+    Vuelve a enlazar desde workbook.xml.rels las partes que openpyxl no escribió. Devuelve
+    los datos de tipos de contenido de las partes restauradas.
+    """
+    rels_path = _rels_path(LIBRO)
+    rels = contenido[rels_path].decode("utf-8")
+    ocupados = set(re.findall(r'\bId="([^"]+)"', rels))
+    agregadas = ""
+    for rid, (tipo, destino) in partes_libro["relaciones"].items():
+        if destino in contenido or f'Type="{tipo}"' in rels:
+            continue
+        nuevo, n = rid, 1
+        while nuevo in ocupados:
+            nuevo, n = f"{rid}_{n}", n + 1
+        ocupados.add(nuevo)
+        agregadas += _relationship_xml(nuevo, tipo, LIBRO, destino)
+        nuevas[destino] = partes_libro["partes"][destino]
+    if agregadas:
+        posicion = rels.rindex("</Relationships>")
+        contenido[rels_path] = (rels[:posicion] + agregadas + rels[posicion:]).encode("utf-8")
+    return {"tipos": {p: tipo for p, tipo in partes_libro["tipos"].items() if p in nuevas}}
+
+
+def restore_sheet_controls(path, controles, partes_libro=None):
+    """
+    Vuelve a insertar en el libro guardado en 'path' los controles leídos con
+    read_sheet_controls() y las partes del libro leídas con read_workbook_parts().
+    Devuelve la lista de hojas cuyos controles no se pudieron restaurar.
+    """
+    if not controles and not partes_libro:
+        return []
+    with zipfile.ZipFile(path) as zf:
+        entradas = [(info, zf.read(info.filename)) for info in zf.infolist()]
+        hojas = _sheet_parts(zf)
+        relaciones_hoja = {parte: _relations(zf, parte) for parte in hojas.values()}
+    contenido = {info.filename: datos for info, datos in entradas}
+    nuevas = {}
+    omitidas = []
+    restauradas_libro = _restore_workbook_parts(contenido, nuevas, partes_libro) if partes_libro else None
+
+    for nombre, datos in controles.items():
+        parte = hojas.get(nombre)
+        if parte is None or parte not in contenido:
+            omitidas.append(nombre)
+            continue
+        xml = contenido[parte].decode("utf-8")
+        relaciones = relaciones_hoja[parte]
+        # Si openpyxl escribió su propio dibujo o comentarios, no se mezclan con los originales.
+        choque = [p for p in datos["partes"] if p in contenido and p.rsplit(".", 1)[-1].lower() != "vml"
+                  and not p.startswith("xl/ctrlProps/")]
+        if (_DRAWING.search(xml) or "<controls>" in xml or choque
+                or any(tipo == RELACION_COMENTARIOS for tipo, _ in relaciones.values())):
+            omitidas.append(nombre)
+            continue
+
+        # Quitar el <legacyDrawing> que deja openpyxl (apunta al mismo VML que el original).
+        ids_vml = {rid for rid, (tipo, _) in relaciones.items() if tipo == f"{NS_REL}/vmlDrawing"}
+        xml = _LEGACY_DRAWING.sub("", xml)
+        # Identificadores de relación sin choques con los que quedan en la hoja.
+        ocupados = set(relaciones) - ids_vml
+        renombrar = {}
+        for rid in datos["relaciones"]:
+            nuevo, n = rid, 1
+            while nuevo in ocupados:
+                nuevo, n = f"{rid}_{n}", n + 1
+            renombrar[rid] = nuevo
+            ocupados.add(nuevo)
+        fragmento = _ID_RELACION.sub(lambda m: f'r:id="{renombrar.get(m.group(1), m.group(1))}"',
+                                     "".join(datos["fragmentos"]))
+
+        # Declarar en la raíz los prefijos que usan los fragmentos (r:, xdr:, x14:, mc:...).
+        inicio = xml.index("<worksheet")
+        fin = xml.index(">", inicio)
+        raiz = xml[inicio:fin]
+        declarados = dict(_XMLNS.findall(raiz))
+        faltantes = "".join(f' xmlns:{prefijo}="{uri}"' for prefijo, uri in datos["xmlns"].items()
+                            if prefijo not in declarados)
+        xml = xml[:fin].rstrip("/") + faltantes + xml[fin:]
+        posicion = _POSTERIORES.search(xml).start()
+        xml = xml[:posicion] + fragmento + xml[posicion:]
+        contenido[parte] = xml.encode("utf-8")
+
+        # Relaciones de la hoja: las de openpyxl (sin su VML) más las de los controles.
+        rels_path = _rels_path(parte)
+        existentes = ""
+        if rels_path in contenido:
+            existentes = re.sub(r"<Relationship\b[^>]*/>",
+                                lambda m: "" if re.search(r'\bId="([^"]+)"', m.group(0)).group(1) in ids_vml else m.group(0),
+                                contenido[rels_path].decode("utf-8"))
+            existentes = existentes[existentes.index("<Relationships"):]
+            existentes = existentes[existentes.index(">") + 1:existentes.rindex("</Relationships>")]
+        agregadas = "".join(_relationship_xml(renombrar[rid], tipo, parte, destino)
+                            for rid, (tipo, destino) in datos["relaciones"].items())
+        rels = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<Relationships xmlns="{NS_PKG_REL}">{existentes}{agregadas}</Relationships>')
+        if rels_path in contenido:
+            contenido[rels_path] = rels.encode("utf-8")
+        else:
+            nuevas[rels_path] = rels.encode("utf-8")
+
+        for parte_control, datos_parte in datos["partes"].items():
+            if parte_control in contenido:
+                contenido[parte_control] = datos_parte
+            else:
+                nuevas[parte_control] = datos_parte
+
+    # Tipos de contenido de las partes restauradas.
+    tipos = contenido["[Content_Types].xml"].decode("utf-8")
+    agregados = ""
+    for datos in list(controles.values()) + ([restauradas_libro] if restauradas_libro else []):
+        for ext, tipo in datos.get("defaults", {}).items():
+            if f'Extension="{ext}"' not in tipos and f'Extension="{ext}"' not in agregados:
+                agregados += f'<Default Extension="{ext}" ContentType="{tipo}"/>'
+        for parte_control, tipo in datos["tipos"].items():
+            if f'PartName="/{parte_control}"' not in tipos and f'PartName="/{parte_control}"' not in agregados:
+                agregados += f'<Override PartName="/{parte_control}" ContentType="{tipo}"/>'
+    if agregados:
+        posicion = tipos.rindex("</Types>")
+        contenido["[Content_Types].xml"] = (tipos[:posicion] + agregados + tipos[posicion:]).encode("utf-8")
+
+    directorio = os.path.dirname(os.path.abspath(path))
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as salida:
+            for info, _ in entradas:
+                salida.writestr(info, contenido[info.filename])
+            for nombre_parte, datos_parte in nuevas.items():
+                salida.writestr(nombre_parte, datos_parte)
+        os.replace(temporal, path)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return omitidas
@@ -0,0 +1,120 @@
+# facturacion/dates.py
+"""
+Normalización de la columna 'FECHA DE PAGO'.
+
+En el archivo de origen la columna mezcla fechas reales, números de serie de Excel
+(p. ej. 45340) y textos 'DD/MM/YYYY'. En lugar de dejar que pandas infiera el formato
+celda por celda, los valores se agrupan por valor único (factorize) y cada valor distinto
+se convierte una sola vez: los números de serie con aritmética sobre la época de Excel y
+los textos con formatos explícitos. El resultado se expande a todas las filas con un
+único acceso por índice.
+
+Las fechas se calculan en datetime64[us] (no en nanosegundos, cuyo rango termina en 2262),
+así que cubren todo el rango de Excel sin desbordarse. Lo que queda fuera de ese rango
+(números de serie menores que 1 o mayores que 2958465, y textos o fechas anteriores al
+serial 1 o posteriores al 31/12/9999) no se puede escribir como fecha en Excel y queda
+como NaT, igual que los valores que no se pueden interpretar; nunca se lanza un error.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+# Época de los números de serie de Excel (sistema 1900). Excel cuenta el 29/02/1900, que no
+# existió, así que los números anteriores a 61 quedan un día corridos; no afecta a fechas reales.
+EPOCA_EXCEL = np.datetime64("1899-12-30", "us")
+# Rango de números de serie válidos en Excel (1 = 01/01/1900, 2958465 = 31/12/9999).
+SERIAL_MINIMO = 1
+SERIAL_MAXIMO = 2958465
+# El mismo rango como fechas (el último día completo, hasta el último microsegundo).
+FECHA_MINIMA = EPOCA_EXCEL + np.timedelta64(SERIAL_MINIMO, "D")
+FECHA_MAXIMA = EPOCA_EXCEL + np.timedelta64(SERIAL_MAXIMO + 1, "D") - np.timedelta64(1, "us")
+
+# Unidad de los resultados.
+TIPO_FECHA = "datetime64[us]"
+MICROSEGUNDOS_POR_DIA = 86_400_000_000
+
+# Formatos de texto aceptados, en orden de prioridad (día antes que mes).
+FORMATOS_FECHA = ('%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+
+
+def _serials_to_datetime(seriales):
+    """Convierte números de serie de Excel (array de float) a datetime64; fuera de rango -> NaT."""
+    seriales = np.asarray(seriales, dtype=float)
+    validos = (seriales >= SERIAL_MINIMO) & (seriales < SERIAL_MAXIMO + 1)
+    resultado = np.full(len(seriales), np.datetime64('NaT'), dtype=TIPO_FECHA)
+    # Aritmética entera en microsegundos: el serial máximo (~2.6e17 us) cabe en int64.
+    microsegundos = np.round(seriales[validos] * MICROSEGUNDOS_POR_DIA).astype(np.int64)
+    resultado[validos] = EPOCA_EXCEL + microsegundos.astype('timedelta64[us]')
+    return resultado
+
+
+def _within_excel_range(fechas):
+    """Deja como NaT las fechas (datetime64[us]) que Excel no puede representar."""
+    fechas = np.asarray(fechas, dtype=TIPO_FECHA)
+    return np.where((fechas < FECHA_MINIMA) | (fechas > FECHA_MAXIMA), np.datetime64('NaT'), fechas)
+
+
+def _strings_to_datetime(textos, formatos=FORMATOS_FECHA):
+    """Convierte textos probando cada formato explícito sobre los que aún no se pudieron leer."""
+    textos = pd.Series(textos, dtype=object).str.strip()
+    resultado = pd.Series(pd.NaT, index=textos.index, dtype=TIPO_FECHA)
+    for formato in formatos:
+        pendientes = resultado.isna() & textos.notna()
+        if not pendientes.any():
+            break
+        convertidos = pd.to_datetime(textos[pendientes], format=formato, errors='coerce')
+        resultado[pendientes] = _within_excel_range(convertidos.to_numpy(dtype=TIPO_FECHA))
+    # Textos que son un número de serie ('45340').
+    pendientes = resultado.isna() & textos.notna()
+    if pendientes.any():
+        numeros = pd.to_numeric(textos[pendientes], errors='coerce').to_numpy(dtype=float)
+        resultado[pendientes] = _serials_to_datetime(numeros)
+    return resultado.to_numpy()
+
+
+def normalize_dates(serie, formatos=FORMATOS_FECHA):
+    """
+    Convierte una columna de fechas mixta (fechas, números de serie de Excel y textos)
+    a datetime64[us]. Los valores vacíos, los que no se pueden interpretar y los que quedan
+    fuera del rango de fechas de Excel quedan como NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+
+    codigos, unicos = pd.factorize(serie)  # vacíos -> -1
+    unicos = np.asarray(unicos, dtype=object)
+    fechas_unicas = np.full(len(unicos), np.datetime64('NaT'), dtype=TIPO_FECHA)
+
+    # Clasificar los valores distintos por tipo (un recorrido sobre los únicos, no sobre las filas).
+    es_fecha = np.array([isinstance(v, (datetime.date, np.datetime64)) for v in unicos], dtype=bool)
+    es_numero = np.array([isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_))
+                          for v in unicos], dtype=bool)
+    es_texto = np.array([isinstance(v, str) for v in unicos], dtype=bool)
+
+    if es_fecha.any():
+        convertidas = pd.to_datetime(pd.Series(unicos[es_fecha]), errors='coerce')
+        fechas_unicas[es_fecha] = _within_excel_range(convertidas.to_numpy(dtype=TIPO_FECHA))
+    if es_numero.any():
+        fechas_unicas[es_numero] = _serials_to_datetime(unicos[es_numero].astype(float))
+    if es_texto.any():
+        fechas_unicas[es_texto] = _strings_to_datetime(unicos[es_texto], formatos)
+
+    fechas = np.full(len(codigos), np.datetime64('NaT'), dtype=TIPO_FECHA)
+    con_valor = codigos >= 0
+    fechas[con_valor] = fechas_unicas[codigos[con_valor]]
+    return pd.Series(fechas, index=serie.index, name=serie.name)
+
+
+def dates_for_write(serie):
+    """
+    Valores de una columna de fechas listos para escribir: objetos fecha y None en lugar de
+    NaT (que se escribiría como texto), calculados sin recorrer las filas en Python.
+    """
+    if pd.api.types.is_datetime64_dtype(serie):
+        # numpy convierte datetime64[us] a datetime.datetime, y NaT a None, en una sola pasada.
+        return serie.to_numpy(dtype='datetime64[us]').astype(object)
+    valores = serie.to_numpy(dtype=object)
+    valores[pd.isna(serie).to_numpy()] = None
+    return valores
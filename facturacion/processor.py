@@ -0,0 +1,775 @@
+# facturacion/processor.py
+"""
+Lógica de procesamiento del Pronóstico de Cobranza, independiente de la interfaz gráfica.
+
+La usan tanto la ventana de Tkinter (facturacion_app.py) como la línea de comandos
+(python -m facturacion).
+"""
+import datetime
+import difflib
+import json
+import logging
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from facturacion.dates import normalize_dates, dates_for_write
+from facturacion.reader import read_origin_sheet
+from facturacion.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+# Definiciones de colores (para relleno de filas)
+COLOR_ELVIRA_RGB = (102, 255, 255)   # #66FFFF (Cian/Azul Claro)
+COLOR_CARLOS_RGB = (204, 255, 153)   # #CCFF99 (Verde/Amarillo Claro)
+COLORES_AGENTE = {'ELVIRA': COLOR_ELVIRA_RGB, 'CARLOS': COLOR_CARLOS_RGB}
+
+# Columnas de destino que toda ruta debe producir: con ellas se intercalan los agentes.
+COLUMNAS_DESTINO_REQUERIDAS = ('AGENTE', 'NOMBRE O RAZON SOCIAL')
+
+MODO_COMPLETO = 'completo'
+MODO_DIFERENCIAL = 'diferencial'
+
+
+def _true_runs(mascara):
+    """Devuelve los tramos (inicio, final) de posiciones consecutivas en True."""
+    bordes = np.diff(np.concatenate(([0], mascara.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(bordes == 1), np.flatnonzero(bordes == -1) - 1))
+
+
+class FacturacionError(Exception):
+    """
+    Error de validación de los archivos (columnas u hojas faltantes).
+    'titulo' y 'mensaje' están pensados para mostrarse al usuario; 'estado' es el
+    texto breve para la barra de estado.
+    """
+    def __init__(self, titulo, mensaje, estado=None):
+        super().__init__(mensaje)
+        self.titulo = titulo
+        self.mensaje = mensaje
+        self.estado = estado or f"Error: {titulo}."
+
+
+class ProcesamientoCancelado(Exception):
+    """El procesamiento se detuvo a pedido del usuario."""
+
+
+def _route_error(num, detalle):
+    return FacturacionError("Error de Configuración", f"Ruta {num}: {detalle}.", f"Error: Ruta {num} no válida.")
+
+
+def _text_list(num, ruta, clave, por_defecto=None):
+    """
+    Lista no vacía de textos de la clave de una ruta, limpios (strip + upper) y sin repetir
+    (se conserva la primera aparición, p. ej. el orden de los agentes al intercalar).
+    """
+    valores = ruta.get(clave, por_defecto)
+    if not isinstance(valores, (list, tuple)) or not valores or not all(isinstance(v, str) for v in valores):
+        raise _route_error(num, f"'{clave}' debe ser una lista no vacía de textos")
+    return list(dict.fromkeys(v.strip().upper() for v in valores))
+
+
+def _is_rgb(rgb):
+    return (isinstance(rgb, (list, tuple)) and len(rgb) == 3
+            and all(isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 255 for v in rgb))
+
+
+class FacturacionProcessor:
+    def __init__(self):
+        self.HOJA_ORIGEN = "TABLA (OK)"
+        self.FILA_INICIO_ENCABEZADOS_ORIGEN = 7
+        self.FILA_INICIO_DATOS_DESTINO = 2
+
+        # Define las columnas a importar y sus nombres en el archivo de destino.
+        self.COLUMNAS_ORIGEN_ORDENADAS = {
+            'EMISOR': 'EMISOR',
+            'NOMBRE O RAZON SOCIAL': 'NOMBRE O RAZON SOCIAL',
+            'TIPO DE DOCUMENTO': 'TIPO DE DOCUMENTO',
+            'CONCEPTO': 'CONCEPTO',
+            'FOLIO': 'FOLIO',
+            'CONTRATO': 'CONTRATO',
+            'PERIODO \nDE \nRENTA': 'PERIODO DE RENTA',
+            'SALDO \nPENDIENTE': 'SALDO PENDIENTE',
+            'FECHA DE PAGO': 'FECHA DE PAGO',
+            'AGENTE': 'AGENTE'
+        }
+        self.TIPOS_DOCUMENTO_INCLUIDOS = ['FACTURA', 'NOTA DE CREDITO', 'SALDO A FAVOR', 'RECIBO DE PAGO']
+        # Agentes cuyos grupos de clientes se intercalan en la hoja, en orden de aparición.
+        self.AGENTES_INTERCALADOS = ['ELVIRA', 'CARLOS']
+        # Color de relleno (RGB) de las filas de cada agente.
+        self.COLORES_AGENTE = dict(COLORES_AGENTE)
+        # Enrutamiento por EMISOR: cada ruta envía las filas de sus emisores a una hoja de la plantilla.
+        # Claves opcionales de cada ruta (si faltan se usan los valores generales de arriba):
+        # 'nombre' (etiqueta en el resumen; por defecto el primer emisor), 'tipos_documento',
+        # 'columnas' (origen -> destino), 'agentes' (intercalado) y 'colores' (agente -> RGB).
+        # Ver load_routes() para cargarlas desde un archivo JSON.
+        self.RUTAS = [
+            {'emisores': ['OVL'], 'hoja': "FACTURACION OVL"},
+            {'emisores': ['LFOV'], 'hoja': "FACTURACION LFOV"},
+        ]
+        # 'completo': limpia y reescribe la hoja; 'diferencial': sólo toca las celdas que cambian.
+        self.MODO_ACTUALIZACION = MODO_COMPLETO
+        # Columnas que identifican una factura en el modo diferencial (alineación y reporte de cambios).
+        self.COLUMNAS_CLAVE = ['EMISOR', 'FOLIO', 'TIPO DE DOCUMENTO']
+        # Motor de lectura del origen: None = automático ('calamine' si está instalado, si no 'openpyxl').
+        self.MOTOR_LECTURA = None
+        # Filas que se convierten y escriben por bloque: acota la memoria de la escritura y el
+        # tamaño de cada llamada a Excel (xlwings). None = toda la hoja en una sola escritura.
+        self.FILAS_POR_BLOQUE = 10000
+
+        # Hoja con los totales de SALDO PENDIENTE por agente, cliente, contrato y antigüedad
+        # (se crea si no existe en la plantilla). None = no escribir el resumen.
+        self.HOJA_RESUMEN = "RESUMEN COBRANZA"
+        # Tramos de antigüedad según los días transcurridos desde FECHA DE PAGO: (días máximos, título).
+        # El último tramo (None) recoge todo lo más antiguo; las filas sin fecha van a 'SIN FECHA'.
+        self.TRAMOS_ANTIGUEDAD = [(0, 'POR VENCER'), (30, '1 A 30 DIAS'), (60, '31 A 60 DIAS'),
+                                  (90, '61 A 90 DIAS'), (None, 'MAS DE 90 DIAS')]
+        # Fecha de referencia para la antigüedad; None = la fecha del día.
+        self.FECHA_CORTE = None
+
+        # Función opcional que recibe el avance: (paso, total_pasos, descripcion, filas).
+        # Puede lanzar ProcesamientoCancelado para detener el proceso entre fases.
+        self.progress_callback = None
+        # Reporte de tiempos por fase (facturacion.tracing.RunReport); None = sin medición.
+        self.report = None
+
+    def routes(self):
+        """
+        Rutas de RUTAS con los valores por defecto completados y los emisores, tipos de
+        documento y agentes ya limpios (strip + upper) y sin repetir. Valida los tipos de cada
+        clave, que las columnas incluyan las de COLUMNAS_DESTINO_REQUERIDAS y que ninguna hoja
+        ni emisor se repita.
+        """
+        if not self.RUTAS:
+            raise FacturacionError("Error de Configuración", "Debe haber al menos una ruta de EMISOR a hoja.",
+                                   "Error: No hay rutas configuradas.")
+        rutas = []
+        hojas = set()
+        emisores = set()
+        for num, ruta in enumerate(self.RUTAS, start=1):
+            if not isinstance(ruta, dict) or not ruta.get('emisores') or not ruta.get('hoja'):
+                raise FacturacionError("Error de Configuración",
+                                       f"La ruta {num} debe indicar 'emisores' y 'hoja'.",
+                                       f"Error: Ruta {num} incompleta.")
+            if not isinstance(ruta['hoja'], str) or not isinstance(ruta.get('nombre') or '', str):
+                raise _route_error(num, "'hoja' y 'nombre' deben ser textos")
+            ruta_emisores = _text_list(num, ruta, 'emisores')
+            if ruta['hoja'] in hojas:
+                raise FacturacionError("Error de Configuración",
+                                       f"La hoja '{ruta['hoja']}' aparece en más de una ruta.",
+                                       f"Error: Hoja '{ruta['hoja']}' repetida en las rutas.")
+            repetidos = emisores.intersection(ruta_emisores)
+            if repetidos:
+                raise FacturacionError("Error de Configuración",
+                                       f"El EMISOR '{sorted(repetidos)[0]}' aparece en más de una ruta.",
+                                       "Error: EMISOR repetido en las rutas.")
+            columnas = ruta.get('columnas', self.COLUMNAS_ORIGEN_ORDENADAS)
+            if (not isinstance(columnas, dict) or not columnas
+                    or not all(isinstance(c, str) and isinstance(d, str) for c, d in columnas.items())):
+                raise _route_error(num, "'columnas' debe relacionar columnas del origen (texto) con columnas de destino (texto)")
+            faltantes = [col for col in COLUMNAS_DESTINO_REQUERIDAS if col not in columnas.values()]
+            if faltantes:
+                raise _route_error(num, f"'columnas' debe incluir las columnas de destino {', '.join(faltantes)}")
+            colores = ruta.get('colores', self.COLORES_AGENTE)
+            if not isinstance(colores, dict) or not all(isinstance(a, str) and _is_rgb(rgb) for a, rgb in colores.items()):
+                raise _route_error(num, "'colores' debe relacionar cada agente con un color [r, g, b] de enteros entre 0 y 255")
+            hojas.add(ruta['hoja'])
+            emisores.update(ruta_emisores)
+            rutas.append({
+                'nombre': ruta.get('nombre') or ruta_emisores[0],
+                'emisores': ruta_emisores,
+                'hoja': ruta['hoja'],
+                'tipos_documento': _text_list(num, ruta, 'tipos_documento', self.TIPOS_DOCUMENTO_INCLUIDOS),
+                'columnas': dict(columnas),
+                'agentes': _text_list(num, ruta, 'agentes', self.AGENTES_INTERCALADOS),
+                'colores': {a.strip().upper(): tuple(rgb) for a, rgb in colores.items()},
+            })
+        return rutas
+
+    def load_routes(self, path):
+        """
+        Reemplaza RUTAS con las de un archivo JSON: una lista de rutas con las mismas claves
+        (los colores como listas [r, g, b]). Devuelve las rutas validadas por routes().
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                rutas = json.load(f)
+        except (OSError, ValueError) as e:
+            raise FacturacionError("Error de Configuración",
+                                   f"No se pudo leer el archivo de rutas '{path}': {e}",
+                                   "Error: Archivo de rutas no válido.")
+        if not isinstance(rutas, list) or not all(isinstance(ruta, dict) for ruta in rutas):
+            raise FacturacionError("Error de Configuración",
+                                   f"El archivo de rutas '{path}' debe contener una lista de rutas.",
+                                   "Error: Archivo de rutas no válido.")
+        anteriores, self.RUTAS = self.RUTAS, rutas
+        try:
+            return self.routes()
+        except FacturacionError:
+            self.RUTAS = anteriores
+            raise
+
+    def _source_columns(self, rutas):
+        """Columnas del origen que usa alguna ruta (más las de los filtros), sin repetir."""
+        columnas = ['EMISOR', 'TIPO DE DOCUMENTO']
+        for ruta in rutas:
+            columnas += [col for col in ruta['columnas'] if col not in columnas]
+        return columnas
+
+    def total_steps(self):
+        """Fases del proceso: lectura, filtro, intercalado, una escritura por hoja, resumen y guardado."""
+        return 3 + len(self.RUTAS) + (1 if self.HOJA_RESUMEN else 0) + 1
+
+    def _report_progress(self, paso, descripcion, filas=None):
+        if self.progress_callback is not None:
+            self.progress_callback(paso, self.total_steps(), descripcion, filas)
+
+    def _span(self, nombre, filas=None, **atributos):
+        return span(self.report, nombre, filas, **atributos)
+
+    def read_origin(self, origin_path):
+        """
+        Lee de la hoja de origen sólo las columnas requeridas y valida que existan todas.
+        """
+        columnas = self._source_columns(self.routes())
+        self._report_progress(1, "Leyendo archivo de origen")
+        with self._span("lectura_origen") as registro:
+            df_origen_con_headers = read_origin_sheet(origin_path, self.HOJA_ORIGEN, self.FILA_INICIO_ENCABEZADOS_ORIGEN,
+                                                      columnas, engine=self.MOTOR_LECTURA)
+            registro['filas'] = len(df_origen_con_headers)
+
+        # --- Asegurarse de que 'FECHA DE PAGO' sea tipo datetime ANTES de procesar ---
+        if 'FECHA DE PAGO' in df_origen_con_headers.columns:
+            # Fechas, números de serie de Excel y textos DD/MM/YYYY; lo que no se pueda leer queda como NaT.
+            with self._span("conversion_fechas", len(df_origen_con_headers)):
+                df_origen_con_headers['FECHA DE PAGO'] = normalize_dates(df_origen_con_headers['FECHA DE PAGO'])
+
+        for col in columnas:
+            if col not in df_origen_con_headers.columns:
+                raise FacturacionError("Error de Columna en Origen",
+                                       f"La columna '{col}' no fue encontrada en la hoja '{self.HOJA_ORIGEN}' del archivo de origen. "
+                                       f"Asegúrese de que el encabezado en la fila {self.FILA_INICIO_ENCABEZADOS_ORIGEN} sea exactamente '{col}'.",
+                                       f"Error: Columna '{col}' no encontrada en origen.")
+        return df_origen_con_headers
+
+    def _normalize_key(self, serie):
+        """
+        Limpia una columna clave (strip + upper) una sola vez, sobre sus valores únicos,
+        y la devuelve como categórica. Los valores vacíos quedan como NaN.
+        """
+        codigos, unicos = pd.factorize(serie)  # NaN -> -1
+        limpios = pd.Index(unicos).astype(str).str.strip().str.upper()
+        # Valores distintos pueden quedar iguales al limpiarlos (' ovl ' y 'OVL').
+        codigos_limpios, categorias = pd.factorize(limpios)
+        codigos = np.where(codigos >= 0, codigos_limpios[codigos] if len(codigos_limpios) else -1, -1)
+        return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=serie.index, name=serie.name)
+
+    def filter_origin(self, df_origen_con_headers, advertencias=None):
+        """
+        Filtra por EMISOR y TIPO DE DOCUMENTO, separa las filas por ruta e intercala los agentes.
+        Devuelve {hoja: df} en el orden de RUTAS. Las advertencias no fatales se agregan a 'advertencias'.
+        """
+        if advertencias is None:
+            advertencias = []
+        rutas = self.routes()
+        hojas_raw = self.split_origin(df_origen_con_headers, advertencias, rutas)
+
+        self._report_progress(3, "Intercalando clientes por agente", sum(len(df) for df in hojas_raw.values()))
+        hojas = {}
+        for ruta in rutas:
+            df_raw = hojas_raw[ruta['hoja']]
+            with self._span("intercalado", len(df_raw), hoja=ruta['hoja']):
+                hojas[ruta['hoja']] = self._interleave_agents(df_raw, ruta['agentes'])
+
+        for titulo, mensaje in advertencias:
+            logger.warning("%s: %s", titulo, mensaje)
+        return hojas
+
+    def split_origin(self, df_origen_con_headers, advertencias, rutas=None):
+        """
+        Aplica los filtros y separa las filas de cada ruta, sin intercalar.
+        Devuelve {hoja: df_raw} con las columnas ya renombradas según la ruta.
+
+        Las columnas clave se limpian una sola vez y cada fila se asigna a su ruta con una
+        búsqueda por categoría (emisor -> ruta, ruta x tipo de documento -> incluido), de modo
+        que el costo no crece con el número de rutas y sólo se copia una vez el subconjunto
+        de filas seleccionado.
+        """
+        rutas = self.routes() if rutas is None else rutas
+        self._report_progress(2, "Filtrando por EMISOR y TIPO DE DOCUMENTO", len(df_origen_con_headers))
+
+        if 'TIPO DE DOCUMENTO' not in df_origen_con_headers.columns:
+            raise FacturacionError("Error de Columna",
+                                   "La columna 'TIPO DE DOCUMENTO' no fue encontrada en el archivo de origen. "
+                                   "Verifique el archivo de origen y la configuración de columnas.",
+                                   "Error: Columna 'TIPO DE DOCUMENTO' no encontrada para filtrar.")
+
+        filas_origen = len(df_origen_con_headers)
+        with self._span("filtro_emisor", filas_origen):
+            emisor = self._normalize_key(df_origen_con_headers['EMISOR'])
+            ruta_por_emisor = {e: num for num, ruta in enumerate(rutas) for e in ruta['emisores']}
+            # Ruta de cada categoría de emisor; la posición extra (-1) es la de los vacíos.
+            ruta_categoria = np.array([ruta_por_emisor.get(e, -1) for e in emisor.cat.categories] + [-1], dtype=np.intp)
+            ruta_fila = ruta_categoria[emisor.cat.codes.to_numpy()]
+        with self._span("filtro_tipo_documento", filas_origen):
+            tipo_documento = self._normalize_key(df_origen_con_headers['TIPO DE DOCUMENTO'])
+            # incluido[ruta, tipo]; la última columna (tipo vacío) y la última fila (sin ruta) quedan en False.
+            incluido = np.zeros((len(rutas) + 1, len(tipo_documento.cat.categories) + 1), dtype=bool)
+            for num, ruta in enumerate(rutas):
+                incluido[num, :-1] = tipo_documento.cat.categories.isin(ruta['tipos_documento'])
+            mascara = incluido[ruta_fila, tipo_documento.cat.codes.to_numpy()]
+
+        columnas_a_seleccionar = [col for col in self._source_columns(rutas) if col in df_origen_con_headers.columns]
+        with self._span("seleccion_filas") as registro:
+            df_seleccion = df_origen_con_headers.loc[mascara, columnas_a_seleccionar]
+            registro['filas'] = len(df_seleccion)
+
+        # Columnas del origen que alguna ruta escribe como 'SALDO PENDIENTE'.
+        columnas_saldo = [col for col in columnas_a_seleccionar
+                          if any(ruta['columnas'].get(col) == 'SALDO PENDIENTE' for ruta in rutas)]
+        if columnas_saldo:
+            with self._span("filtro_saldo_numerico", len(df_seleccion)):
+                for col in columnas_saldo:
+                    df_seleccion[col] = pd.to_numeric(df_seleccion[col], errors='coerce')
+        else:
+            advertencias.append(("Advertencia de Columna", "La columna 'SALDO \nPENDIENTE' no fue encontrada después de los filtros anteriores. "
+                                                           "No se pudo verificar el tipo de dato de SALDO PENDIENTE, pero se procederá con los filtros existentes."))
+
+        if df_seleccion.empty:
+            emisores = "/".join(e for ruta in rutas for e in ruta['emisores'])
+            advertencias.append(("Advertencia", f"No se encontraron filas que cumplan los criterios de filtro (EMISOR {emisores} o TIPO DE DOCUMENTO) en el archivo de origen. El archivo de salida estará vacío."))
+
+        # Separar las rutas con un solo agrupamiento sobre el número de ruta de cada fila.
+        with self._span("separacion_emisor", len(df_seleccion), rutas=len(rutas)):
+            grupos = df_seleccion.groupby(ruta_fila[mascara], sort=False).indices
+            sin_filas = np.array([], dtype=np.intp)
+            hojas = {}
+            for num, ruta in enumerate(rutas):
+                columnas = [col for col in ruta['columnas'] if col in df_seleccion.columns]
+                hojas[ruta['hoja']] = (df_seleccion.take(grupos.get(num, sin_filas))[columnas]
+                                       .rename(columns=ruta['columnas']))
+            return hojas
+
+    def prepare(self, origin_path, advertencias=None):
+        """Lectura y filtrado del archivo de origen. Devuelve {hoja: df}."""
+        return self.filter_origin(self.read_origin(origin_path), advertencias)
+
+    def _interleave_agents(self, df_input, agentes_intercalados=None):
+        """
+        Intercala los grupos de clientes de los agentes indicados (por defecto AGENTES_INTERCALADOS,
+        en ese orden) para su presentación: primer cliente de cada agente, luego el segundo, etc.
+        Los clientes de cada agente van en orden alfabético y las filas de un mismo cliente
+        conservan su orden original. Se descartan las filas de otros agentes o sin cliente.
+
+        En lugar de construir un DataFrame por cliente, se calcula una clave de orden
+        (posición del cliente dentro de su agente, orden del agente) y se aplica un único
+        argsort estable.
+        """
+        if df_input.empty:
+            return df_input
+        if agentes_intercalados is None:
+            agentes_intercalados = self.AGENTES_INTERCALADOS
+
+        agentes = self._normalize_key(df_input['AGENTE'])
+        orden_agente = pd.Series(range(len(agentes_intercalados)), index=agentes_intercalados)
+        agente_idx = agentes.map(orden_agente).astype(float).fillna(-1).to_numpy(dtype=np.int64)
+        # Orden alfabético de clientes, igual que groupby(sort=True); sin cliente -> -1.
+        cliente_cod = pd.factorize(df_input['NOMBRE O RAZON SOCIAL'], sort=True)[0]
+
+        filas = np.flatnonzero((agente_idx >= 0) & (cliente_cod >= 0))
+        agente_idx = agente_idx[filas]
+        cliente_cod = cliente_cod[filas]
+
+        # Posición de cada cliente dentro de su agente (0 = primer cliente en orden alfabético).
+        num_clientes = int(cliente_cod.max()) + 1 if len(filas) else 1
+        pares, inversa = np.unique(agente_idx * num_clientes + cliente_cod, return_inverse=True)
+        agente_par = pares // num_clientes
+        rango_cliente = np.arange(len(pares)) - np.searchsorted(agente_par, agente_par, side='left')
+
+        clave = rango_cliente[inversa] * len(agentes_intercalados) + agente_idx
+        orden = filas[np.argsort(clave, kind='stable')]
+        return df_input.take(orden).reset_index(drop=True)
+
+    def _row_fill_agents(self, df_sheet, colores=None):
+        """
+        Calcula, para cada fila, el agente cuyo color se aplica: el valor de 'AGENTE' y,
+        si no corresponde a ningún agente con color, el de 'FOLIO'. None = sin relleno.
+        """
+        colores = self.COLORES_AGENTE if colores is None else colores
+        agentes = pd.Series(None, index=df_sheet.index, dtype=object)
+        # 'AGENTE' tiene prioridad sobre 'FOLIO', por eso se aplica al final.
+        for col in ('FOLIO', 'AGENTE'):
+            if col in df_sheet.columns:
+                valores = df_sheet[col].astype(str).str.strip().str.upper()
+                agentes = valores.where(valores.isin(list(colores)), agentes)
+        return agentes
+
+    def _color_runs(self, agentes, first_row, colores=None):
+        """
+        Agrupa filas consecutivas con el mismo agente en tramos (first_row, last_row, color),
+        de modo que el costo de aplicar colores depende del número de tramos y no de filas.
+        """
+        if agentes.empty:
+            return []
+        colores = self.COLORES_AGENTE if colores is None else colores
+        codigos, agentes_unicos = pd.factorize(agentes)  # None -> -1
+        cambios = np.flatnonzero(np.diff(codigos)) + 1
+        inicios = np.concatenate(([0], cambios))
+        finales = np.concatenate((cambios, [len(codigos)])) - 1
+        runs = []
+        for inicio, final in zip(inicios, finales):
+            codigo = codigos[inicio]
+            color = colores[agentes_unicos[codigo]] if codigo != -1 else None
+            runs.append((first_row + int(inicio), first_row + int(final), color))
+        return runs
+
+    def _values_for_write(self, df_sheet):
+        """Matriz de valores lista para escribir en la hoja (no modifica df_sheet)."""
+        valores = df_sheet.to_numpy(dtype=object)
+        # --- Manejo de NaT (Not a Time) en 'FECHA DE PAGO' antes de escribir a Excel ---
+        if 'FECHA DE PAGO' in df_sheet.columns:
+            # Convertir NaT (valores de fecha no válidos) a None, que se escribe como celda vacía.
+            # Esto evita que 'NaT' se escriba como texto y cause problemas de formato en Excel.
+            valores[:, df_sheet.columns.get_loc('FECHA DE PAGO')] = dates_for_write(df_sheet['FECHA DE PAGO'])
+        return valores
+
+    def _iter_value_blocks(self, df_sheet):
+        """
+        Genera (desplazamiento, valores) por bloques de FILAS_POR_BLOQUE filas. Cada bloque se
+        convierte justo antes de escribirlo, de modo que nunca existe la matriz de toda la hoja.
+        """
+        # Sin tamaño (None o 0) se escribe toda la hoja de una vez.
+        tamano = max(self.FILAS_POR_BLOQUE or len(df_sheet), 1)
+        for inicio in range(0, len(df_sheet), tamano):
+            yield inicio, self._values_for_write(df_sheet.iloc[inicio:inicio + tamano])
+
+    def _process_single_sheet(self, writer, sheet_name, df_sheet, colores=None):
+        """
+        Procesa una única hoja de destino con el motor de escritura indicado.
+        Limpia datos, escribe nuevos datos y aplica formatos básicos (colores y fechas).
+        La lógica de inserción de filas, bordes y validación se deja a VBA.
+        """
+        try:
+            num_output_cols = df_sheet.shape[1]
+
+            # Colores por tramos de filas, calculados con pandas antes de escribir nada.
+            with self._span("calculo_colores", len(df_sheet)):
+                runs = self._color_runs(self._row_fill_agents(df_sheet, colores), self.FILA_INICIO_DATOS_DESTINO, colores)
+
+            last_data_row_written = self.FILA_INICIO_DATOS_DESTINO + df_sheet.shape[0] - 1
+            if df_sheet.empty:
+                last_data_row_written = self.FILA_INICIO_DATOS_DESTINO - 1
+
+            # Sólo se limpian las filas anteriores que quedan por debajo de los datos nuevos: las
+            # demás se sobrescriben (valores en todas las columnas y relleno en cada tramo).
+            last_row_in_sheet = writer.last_row(sheet_name)
+            if last_row_in_sheet > last_data_row_written:
+                with self._span("limpieza", last_row_in_sheet - last_data_row_written):
+                    writer.clear_block(sheet_name, last_data_row_written + 1, last_row_in_sheet, num_output_cols)
+
+            # Escribir los datos procesados (DataFrame a Excel)
+            if not df_sheet.empty:
+                with self._span("escritura_valores", len(df_sheet), filas_por_bloque=self.FILAS_POR_BLOQUE):
+                    writer.write_blocks(sheet_name, self.FILA_INICIO_DATOS_DESTINO, self._iter_value_blocks(df_sheet))
+
+            fecha_pago_col_idx = list(df_sheet.columns).index('FECHA DE PAGO') if 'FECHA DE PAGO' in df_sheet.columns else -1
+            fecha_pago_col_excel = fecha_pago_col_idx + 1 if fecha_pago_col_idx != -1 else -1
+
+            # Aplica formato de colores (por agente) a todas las columnas importadas.
+            if last_data_row_written >= self.FILA_INICIO_DATOS_DESTINO:
+                # Todos los tramos, también los sin color: así se quita el relleno que tuviera la fila antes.
+                with self._span("colores", len(df_sheet), tramos=len(runs)):
+                    writer.fill_runs(sheet_name, runs, num_output_cols)
+
+                # --- Aplicar formato de Fecha a toda la columna 'FECHA DE PAGO' después de escribir los datos ---
+                if fecha_pago_col_excel != -1:
+                    with self._span("formato_fecha", len(df_sheet)):
+                        writer.set_number_format(sheet_name, self.FILA_INICIO_DATOS_DESTINO, last_data_row_written,
+                                                 fecha_pago_col_excel, 'DD/MM/YYYY')
+
+            # Ajustar ancho de columnas automáticamente
+            with self._span("autofit", len(df_sheet)):
+                writer.autofit(sheet_name)
+
+        except Exception as e:
+            logger.error("ERROR en _process_single_sheet para hoja '%s': %s", sheet_name, e)
+            raise
+
+    def cutoff_date(self):
+        """Fecha de referencia para los tramos de antigüedad del resumen."""
+        return pd.Timestamp(self.FECHA_CORTE or datetime.date.today()).normalize()
+
+    def write_fingerprint(self):
+        """
+        Texto con la configuración que cambia lo escrito en la plantilla sin cambiar los datos
+        preparados (el resumen depende de la fecha de corte). Lo usa el caché de escrituras.
+        """
+        if not self.HOJA_RESUMEN:
+            return ""
+        return f"{self.HOJA_RESUMEN}|{self.cutoff_date().date().isoformat()}|{self.TRAMOS_ANTIGUEDAD}"
+
+    def summarize_collections(self, hojas):
+        """
+        Totales de SALDO PENDIENTE por EMISOR, AGENTE, cliente, CONTRATO y tramo de antigüedad,
+        a partir de {hoja: df} (el EMISOR es el 'nombre' de la ruta de cada hoja).
+        Las claves se convierten a códigos enteros y se agrupa una sola vez sobre todas las filas;
+        los tramos pasan a columnas. Devuelve un DataFrame con una fila por (emisor, agente,
+        cliente, contrato), las columnas de cada tramo y 'TOTAL'.
+        """
+        titulos = [titulo for _, titulo in self.TRAMOS_ANTIGUEDAD] + ['SIN FECHA']
+        columnas_clave = ['EMISOR', 'AGENTE', 'NOMBRE O RAZON SOCIAL', 'CONTRATO']
+        columnas_datos = ['AGENTE', 'NOMBRE O RAZON SOCIAL', 'CONTRATO', 'FECHA DE PAGO', 'SALDO PENDIENTE']
+        hojas = [(ruta['nombre'], hojas[ruta['hoja']].reindex(columns=columnas_datos))
+                 for ruta in self.routes() if ruta['hoja'] in hojas]
+        df = pd.concat([df_hoja for _, df_hoja in hojas], ignore_index=True) if hojas else pd.DataFrame()
+        if df.empty:
+            return pd.DataFrame(columns=columnas_clave + titulos + ['TOTAL'])
+
+        # Claves precalculadas: el emisor sale de la hoja, el resto se factoriza (orden alfabético).
+        emisores = pd.Index([emisor for emisor, _ in hojas])
+        emisor_cod = np.repeat(np.arange(len(hojas)), [len(df_hoja) for _, df_hoja in hojas])
+        agente = self._normalize_key(df['AGENTE'])
+        agente_cod, agentes = pd.factorize(agente.astype(object), sort=True)
+        cliente_cod, clientes = pd.factorize(df['NOMBRE O RAZON SOCIAL'], sort=True)
+        # CONTRATO puede mezclar números y textos: se ordena por su texto sin cambiar los valores.
+        contrato_cod, contratos = pd.factorize(df['CONTRATO'])
+        orden = np.argsort(contratos.astype(str), kind='stable')
+        posicion = np.empty_like(orden)
+        posicion[orden] = np.arange(len(orden))
+        contrato_cod = np.where(contrato_cod >= 0, posicion[np.maximum(contrato_cod, 0)], -1)
+        contratos = contratos[orden]
+
+        # Tramo de antigüedad: días transcurridos desde FECHA DE PAGO hasta la fecha de corte.
+        dias = (self.cutoff_date() - pd.to_datetime(df['FECHA DE PAGO'])).dt.days.to_numpy(dtype=float)
+        limites = [maximo for maximo, _ in self.TRAMOS_ANTIGUEDAD if maximo is not None]
+        tramo_cod = np.searchsorted(np.array(limites, dtype=float), dias, side='left')
+        tramo_cod[np.isnan(dias)] = len(titulos) - 1
+
+        saldo = pd.to_numeric(df['SALDO PENDIENTE'], errors='coerce').to_numpy(dtype=float)
+        totales = (pd.Series(saldo)
+                   .groupby([emisor_cod, agente_cod, cliente_cod, contrato_cod, tramo_cod], sort=True)
+                   .sum()
+                   .unstack(fill_value=0.0)
+                   .reindex(columns=range(len(titulos)), fill_value=0.0))
+
+        def etiquetas(indice, codigos):
+            # Código -1 = valor vacío.
+            return [indice[codigo] if codigo >= 0 else None for codigo in codigos]
+
+        e, a, c, k = (totales.index.get_level_values(nivel).to_numpy() for nivel in range(4))
+        resumen = pd.DataFrame({'EMISOR': etiquetas(emisores, e), 'AGENTE': etiquetas(agentes, a),
+                                'NOMBRE O RAZON SOCIAL': etiquetas(clientes, c), 'CONTRATO': etiquetas(contratos, k)})
+        resumen[titulos] = totales.to_numpy()
+        resumen['TOTAL'] = resumen[titulos].sum(axis=1)
+        return resumen
+
+    def _write_summary(self, writer, resumen):
+        """
+        Escribe la hoja de resumen como valores fijos (sin fórmulas): primero los totales por
+        emisor y agente, después el detalle por cliente y contrato.
+        """
+        hoja = self.HOJA_RESUMEN
+        titulos = list(resumen.columns[4:])
+        num_cols = 4 + len(titulos)
+
+        writer.ensure_sheet(hoja)
+        ultima = writer.last_row(hoja)
+        if ultima >= 1:
+            # Sólo los valores: la hoja de resumen no lleva rellenos que restablecer.
+            writer.clear_values(hoja, 1, ultima, num_cols)
+
+        por_agente = resumen.groupby(['EMISOR', 'AGENTE'], sort=False, dropna=False)[titulos].sum().reset_index()
+        total_general = resumen[titulos].sum()
+        filas = [[f"RESUMEN DE COBRANZA AL {self.cutoff_date():%d/%m/%Y}"] + [None] * (num_cols - 1),
+                 [None] * num_cols,
+                 ['EMISOR', 'AGENTE', None, None] + titulos]
+        filas += [[fila.EMISOR, fila.AGENTE, None, None] + [fila[t] for t in titulos] for _, fila in por_agente.iterrows()]
+        filas.append(['TOTAL', None, None, None] + list(total_general))
+        filas.append([None] * num_cols)
+        fila_detalle = len(filas) + 1
+        filas.append(list(resumen.columns))
+        writer.write_rows(hoja, 1, filas)
+        if not resumen.empty:
+            writer.write_rows(hoja, fila_detalle + 1, resumen.to_numpy(dtype=object))
+
+        ultima_fila = fila_detalle + len(resumen)
+        for col in range(5, num_cols + 1):
+            writer.set_number_format(hoja, 4, ultima_fila, col, '#,##0.00')
+        writer.autofit(hoja)
+
+    def _diff_report(self, existentes, nuevos, columnas):
+        """
+        Cuenta las facturas insertadas, modificadas y eliminadas, identificadas por
+        COLUMNAS_CLAVE (EMISOR, FOLIO, TIPO DE DOCUMENTO), entre el contenido actual de la
+        hoja y los datos nuevos.
+        """
+        posiciones = [columnas.index(col) for col in self.COLUMNAS_CLAVE if col in columnas]
+        filas_viejas = Counter(map(tuple, existentes))
+        filas_nuevas = Counter(map(tuple, nuevos))
+        # Sólo las filas que no aparecen idénticas en ambos lados cuentan como cambios.
+        claves_viejas = Counter(tuple(fila[i] for i in posiciones) for fila in (filas_viejas - filas_nuevas).elements())
+        claves_nuevas = Counter(tuple(fila[i] for i in posiciones) for fila in (filas_nuevas - filas_viejas).elements())
+        return {
+            'insertadas': sum((claves_nuevas - claves_viejas).values()),
+            'modificadas': sum((claves_nuevas & claves_viejas).values()),
+            'eliminadas': sum((claves_viejas - claves_nuevas).values()),
+        }
+
+    def _align_rows(self, existentes, nuevos, columnas):
+        """
+        Alinea las filas actuales de la hoja con las nuevas por COLUMNAS_CLAVE (difflib sobre
+        las claves, en orden). Devuelve (movimientos, filas_distintas, sobrantes):
+        - movimientos: (posición en los datos nuevos, cantidad) de filas a insertar (> 0) o
+          eliminar (< 0) para que las filas que se conservan queden en su lugar;
+        - filas_distintas: máscara de las filas nuevas que hay que escribir;
+        - sobrantes: filas actuales que quedan al final, después de la última fila nueva.
+        Así una factura insertada o eliminada sólo mueve las filas de abajo en lugar de
+        cambiar el contenido de todas.
+        """
+        posiciones = [columnas.index(col) for col in self.COLUMNAS_CLAVE if col in columnas] or list(range(len(columnas)))
+        claves_viejas = [tuple(fila[i] for i in posiciones) for fila in existentes]
+        claves_nuevas = [tuple(fila[i] for i in posiciones) for fila in nuevos]
+        bloques = difflib.SequenceMatcher(None, claves_viejas, claves_nuevas, autojunk=False).get_opcodes()
+
+        movimientos = []
+        filas_distintas = np.ones(len(nuevos), dtype=bool)
+        sobrantes = 0
+        for _, i1, i2, j1, j2 in bloques:
+            # 'equal' y el principio de 'replace' se comparan fila a fila; el resto se inserta o elimina.
+            comunes = min(i2 - i1, j2 - j1)
+            if comunes:
+                filas_distintas[j1:j1 + comunes] = (existentes[i1:i1 + comunes] != nuevos[j1:j1 + comunes]).any(axis=1)
+            if i2 - i1 > comunes:
+                if i2 == len(existentes) and j2 == len(nuevos):
+                    sobrantes = i2 - i1 - comunes   # al final: basta con limpiarlas
+                else:
+                    movimientos.append((j1 + comunes, comunes - (i2 - i1)))
+            elif j2 - j1 > comunes and i2 < len(existentes):
+                movimientos.append((j1 + comunes, j2 - j1 - comunes))   # al final no hay nada que bajar
+        return movimientos, filas_distintas, sobrantes
+
+    def _update_single_sheet(self, writer, sheet_name, df_sheet, colores=None):
+        """
+        Actualización diferencial de una hoja: lee el contenido actual en una sola operación
+        y lo alinea con los datos nuevos por COLUMNAS_CLAVE. Las facturas nuevas o eliminadas
+        insertan o eliminan filas (el resto de la hoja se desplaza sin reescribirse) y sólo se
+        escriben (valores, relleno y formato de fecha) las filas que cambian; las filas
+        sobrantes del final se limpian.
+
+        El resultado es el mismo que el de _process_single_sheet, pero el costo depende del
+        número de filas que cambian. Devuelve el reporte de cambios de la hoja.
+        """
+        try:
+            num_output_cols = df_sheet.shape[1]
+            primera_fila = self.FILA_INICIO_DATOS_DESTINO
+
+            nuevos = np.array(self._values_for_write(df_sheet), dtype=object).reshape(-1, num_output_cols)
+            nuevos[pd.isna(nuevos)] = None
+
+            ultima_usada = writer.last_used_row(sheet_name)
+            existentes = np.empty((0, num_output_cols), dtype=object)
+            if ultima_usada >= primera_fila:
+                with self._span("lectura_plantilla", ultima_usada - primera_fila + 1):
+                    existentes = np.array(writer.read_block(sheet_name, primera_fila, ultima_usada, num_output_cols),
+                                          dtype=object).reshape(-1, num_output_cols)
+                existentes[pd.isna(existentes)] = None
+                no_vacias = np.flatnonzero(pd.notna(existentes).any(axis=1))
+                existentes = existentes[:no_vacias[-1] + 1] if len(no_vacias) else existentes[:0]
+
+            with self._span("comparacion", len(nuevos)):
+                movimientos, filas_distintas, sobrantes = self._align_rows(existentes, nuevos, list(df_sheet.columns))
+
+            if movimientos:
+                with self._span("desplazamiento", len(movimientos)):
+                    writer.shift_rows(sheet_name, [(primera_fila + posicion, cantidad) for posicion, cantidad in movimientos],
+                                      num_output_cols)
+
+            fecha_pago_col_excel = list(df_sheet.columns).index('FECHA DE PAGO') + 1 if 'FECHA DE PAGO' in df_sheet.columns else -1
+            agentes = self._row_fill_agents(df_sheet, colores)
+
+            filas_escritas = int(filas_distintas.sum())
+            with self._span("escritura_diferencial", filas_escritas):
+                for inicio, final in _true_runs(filas_distintas):
+                    writer.write_rows(sheet_name, primera_fila + inicio, nuevos[inicio:final + 1])
+                    writer.fill_runs(sheet_name, self._color_runs(agentes.iloc[inicio:final + 1], primera_fila + inicio, colores),
+                                     num_output_cols)
+                    if fecha_pago_col_excel != -1:
+                        writer.set_number_format(sheet_name, primera_fila + inicio, primera_fila + final,
+                                                 fecha_pago_col_excel, 'DD/MM/YYYY')
+
+            if sobrantes:
+                with self._span("limpieza", sobrantes):
+                    writer.clear_block(sheet_name, primera_fila + len(nuevos), primera_fila + len(nuevos) + sobrantes - 1,
+                                       num_output_cols)
+
+            if filas_escritas:
+                with self._span("autofit", filas_escritas):
+                    writer.autofit(sheet_name, grow_only=True)
+
+            reporte = self._diff_report(existentes, nuevos, list(df_sheet.columns))
+            reporte.update({
+                'filas_escritas': filas_escritas,
+                'filas_insertadas': sum(cantidad for _, cantidad in movimientos if cantidad > 0),
+                'filas_borradas': sobrantes - sum(cantidad for _, cantidad in movimientos if cantidad < 0),
+            })
+            return reporte
+
+        except Exception as e:
+            logger.error("ERROR en _update_single_sheet para hoja '%s': %s", sheet_name, e)
+            raise
+
+    def write_template(self, writer, template_path, hojas):
+        """
+        Abre la plantilla con el motor indicado, escribe cada hoja de {hoja: df} y el resumen,
+        y guarda una sola vez sobre el mismo archivo. El motor queda abierto para reutilizarlo
+        con otro libro. En modo diferencial devuelve el reporte de cambios por hoja.
+        """
+        colores_por_hoja = {ruta['hoja']: ruta['colores'] for ruta in self.routes()}
+        with self._span("inicio_motor", motor=writer.nombre):
+            writer.start()
+        with self._span("apertura_plantilla", motor=writer.nombre):
+            writer.open(template_path)
+        try:
+            hojas_plantilla = writer.sheet_names()
+            for hoja in hojas:
+                if hoja not in hojas_plantilla:
+                    raise FacturacionError("Error en Plantilla",
+                                           f"La hoja '{hoja}' no fue encontrada en el archivo de plantilla. Asegúrese de que el nombre sea correcto.",
+                                           f"Error: Hoja '{hoja}' no encontrada en la plantilla.")
+
+            # Escritura y formato básico en las hojas de la plantilla
+            cambios = {}
+            for num_hoja, (hoja, df_hoja) in enumerate(hojas.items()):
+                self._report_progress(4 + num_hoja, f"Escribiendo hoja '{hoja}'", len(df_hoja))
+                colores = colores_por_hoja.get(hoja)
+                with self._span("hoja", len(df_hoja), hoja=hoja, modo=self.MODO_ACTUALIZACION):
+                    if self.MODO_ACTUALIZACION == MODO_DIFERENCIAL:
+                        cambios[hoja] = self._update_single_sheet(writer, hoja, df_hoja, colores)
+                    else:
+                        self._process_single_sheet(writer, hoja, df_hoja, colores)
+
+            if self.HOJA_RESUMEN:
+                self._report_progress(self.total_steps() - 1, f"Escribiendo hoja '{self.HOJA_RESUMEN}'")
+                with self._span("resumen", sum(len(df_hoja) for df_hoja in hojas.values()), hoja=self.HOJA_RESUMEN) as registro:
+                    resumen = self.summarize_collections(hojas)
+                    registro['filas_resumen'] = len(resumen)
+                    self._write_summary(writer, resumen)
+
+            # Guardar el archivo de plantilla actualizado (sobrescribe el original)
+            self._report_progress(self.total_steps(), "Guardando plantilla")
+            with self._span("guardado"):
+                writer.save()
+        finally:
+            writer.close(save=False)
+        return cambios
+
+    def process(self, origin_path, template_path, writer, advertencias=None):
+        """
+        Procesa un archivo de origen completo y actualiza la plantilla.
+        Devuelve un diccionario con el número de filas escritas por hoja.
+        """
+        hojas = self.prepare(origin_path, advertencias)
+        self.write_template(writer, template_path, hojas)
+        return {hoja: len(df_hoja) for hoja, df_hoja in hojas.items()}
@@ -0,0 +1,95 @@
+# facturacion/reader.py
+"""
+Lector rápido de la hoja de origen ('TABLA (OK)').
+
+En lugar de convertir todas las columnas y celdas de la hoja (pd.read_excel), sólo se
+materializan las columnas requeridas y se descartan las filas vacías del final, que suelen
+venir de celdas con formato pero sin datos.
+
+- 'calamine': usa python-calamine (muy rápido) si está instalado.
+- 'openpyxl': recorre la hoja en modo de sólo lectura (streaming), fila por fila.
+"""
+import importlib.util
+
+import pandas as pd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+def calamine_available():
+    return importlib.util.find_spec("python_calamine") is not None
+
+
+def default_engine():
+    return "calamine" if calamine_available() else "openpyxl"
+
+
+def _drop_trailing_empty_rows(df):
+    """Quita las filas completamente vacías al final del DataFrame."""
+    no_vacias = df.notna().any(axis=1).to_numpy().nonzero()[0]
+    ultima = no_vacias[-1] + 1 if len(no_vacias) else 0
+    if ultima < len(df):
+        df = df.iloc[:ultima]
+    return df
+
+
+def _read_calamine(path, sheet_name, header_row, columnas):
+    requeridas = set(columnas)
+    df = pd.read_excel(path, sheet_name=sheet_name, header=header_row - 1, engine="calamine",
+                       usecols=lambda col: col in requeridas)
+    return df[[col for col in columnas if col in df.columns]]
+
+
+def _read_openpyxl(path, sheet_name, header_row, columnas):
+    if openpyxl is None:
+        raise ImportError("La librería openpyxl no está instalada. Instálela con: pip install openpyxl")
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ValueError(f"No se encontró la hoja '{sheet_name}' en el archivo de origen.")
+        ws = wb[sheet_name]
+        # No confiar en la dimensión declarada en el archivo: se lee hasta la última fila real.
+        ws.reset_dimensions()
+
+        # Resolver la fila de encabezados una sola vez (primera aparición de cada nombre).
+        encabezados = next(ws.iter_rows(min_row=header_row, max_row=header_row, values_only=True), ())
+        indices = {}
+        for idx, nombre in enumerate(encabezados):
+            if nombre in columnas and nombre not in indices:
+                indices[nombre] = idx
+        seleccion = [col for col in columnas if col in indices]
+        posiciones = [indices[col] for col in seleccion]
+        if not posiciones:
+            return pd.DataFrame()
+
+        valores = [[] for _ in seleccion]
+        max_col = max(posiciones) + 1
+        for fila in ws.iter_rows(min_row=header_row + 1, max_col=max_col, values_only=True):
+            # Las filas vacías intermedias se conservan (como en calamine); las del final las
+            # descarta _drop_trailing_empty_rows.
+            for lista, pos in zip(valores, posiciones):
+                lista.append(fila[pos] if pos < len(fila) else None)
+    finally:
+        wb.close()
+
+    return pd.DataFrame({col: pd.Series(lista) for col, lista in zip(seleccion, valores)})
+
+
+def read_origin_sheet(path, sheet_name, header_row, columnas, engine=None):
+    """
+    Lee de la hoja 'sheet_name' sólo las columnas 'columnas' (nombres del encabezado en la
+    fila 'header_row', base 1) y devuelve un DataFrame sin las filas vacías del final.
+    Las columnas que no existan en la hoja simplemente no aparecen en el resultado.
+    """
+    engine = engine or default_engine()
+    if engine == "calamine":
+        df = _read_calamine(path, sheet_name, header_row, columnas)
+    elif engine == "openpyxl":
+        df = _read_openpyxl(path, sheet_name, header_row, columnas)
+    else:
+        raise ValueError(f"Motor de lectura desconocido: '{engine}'. Opciones: calamine, openpyxl")
+    return _drop_trailing_empty_rows(df).reset_index(drop=True)
@@ -0,0 +1,130 @@
+# facturacion/tracing.py
+"""
+Medición del tiempo de cada fase del procesamiento.
+
+RunReport registra intervalos ("spans") con nombre: duración, filas procesadas y
+variación de memoria (RSS) del proceso. Los intervalos pueden anidarse (por ejemplo,
+'escritura_valores' dentro de 'hoja'), y el reporte se exporta como JSON.
+
+profiled() ejecuta un bloque bajo cProfile o pyinstrument y guarda el resultado.
+"""
+import contextlib
+import cProfile
+import json
+import os
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+PERFILADORES = ("cprofile", "pyinstrument")
+
+_PAGINA = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Memoria residente (RSS) actual del proceso en bytes, o None si no se puede medir."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGINA
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RunReport:
+    """Intervalos medidos durante un procesamiento, en el orden en que empiezan."""
+
+    def __init__(self):
+        self.spans = []
+        self._inicio = time.perf_counter()
+        self._abiertos = []
+
+    @contextlib.contextmanager
+    def span(self, nombre, filas=None, **atributos):
+        """
+        Mide el bloque como un intervalo 'nombre'. Se puede completar dentro del bloque
+        con el diccionario devuelto (p. ej. span['filas'] = n).
+        """
+        registro = {"nombre": nombre, "padre": self._abiertos[-1]["nombre"] if self._abiertos else None,
+                    "nivel": len(self._abiertos), "filas": filas, **atributos}
+        self.spans.append(registro)
+        self._abiertos.append(registro)
+        rss_inicial = current_rss()
+        inicio = time.perf_counter()
+        registro["inicio"] = round(inicio - self._inicio, 6)
+        try:
+            yield registro
+        except BaseException as e:
+            registro["error"] = type(e).__name__
+            raise
+        finally:
+            registro["segundos"] = round(time.perf_counter() - inicio, 6)
+            rss_final = current_rss()
+            registro["memoria_mb"] = round((rss_final - rss_inicial) / (1024 * 1024), 3) if rss_final is not None and rss_inicial is not None else None
+            self._abiertos.pop()
+
+    def totals(self):
+        """Segundos acumulados por nombre de intervalo."""
+        totales = {}
+        for registro in self.spans:
+            totales[registro["nombre"]] = totales.get(registro["nombre"], 0.0) + registro.get("segundos", 0.0)
+        return {nombre: round(segundos, 6) for nombre, segundos in totales.items()}
+
+    def to_dict(self, **datos):
+        return {**datos, "segundos": round(time.perf_counter() - self._inicio, 6), "fases": self.spans,
+                "totales": self.totals()}
+
+    def save(self, path, **datos):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(**datos), f, ensure_ascii=False, indent=1, default=str)
+
+
+def span(report, nombre, filas=None, **atributos):
+    """report.span(...) o un bloque sin medición si report es None."""
+    if report is None:
+        return contextlib.nullcontext({})
+    return report.span(nombre, filas, **atributos)
+
+
+def profiler_available(perfilador):
+    return perfilador == "cprofile" or (perfilador == "pyinstrument" and pyinstrument is not None)
+
+
+@contextlib.contextmanager
+def profiled(path, perfilador="cprofile"):
+    """
+    Ejecuta el bloque bajo un perfilador y guarda el resultado en 'path':
+    cProfile en formato pstats (.prof) o pyinstrument en HTML (o texto si 'path' no es .html).
+    """
+    if perfilador == "pyinstrument":
+        if pyinstrument is None:
+            raise ImportError("La librería pyinstrument no está instalada. Instálela con: pip install pyinstrument")
+        perfil = pyinstrument.Profiler()
+        perfil.start()
+        try:
+            yield
+        finally:
+            perfil.stop()
+            salida = perfil.output_html() if path.lower().endswith(".html") else perfil.output_text()
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(salida)
+    elif perfilador == "cprofile":
+        perfil = cProfile.Profile()
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+            perfil.dump_stats(path)
+    else:
+        raise ValueError(f"Perfilador desconocido: '{perfilador}'. Opciones: {', '.join(PERFILADORES)}")
@@ -0,0 +1,185 @@
+# facturacion/watcher.py
+"""
+Vigilancia de carpetas: procesa cada archivo de origen (.xlsx/.xlsm) nuevo o modificado
+que aparece en las carpetas vigiladas.
+
+- Las carpetas se revisan cada pocos segundos (sin dependencias adicionales; funciona
+  también en carpetas compartidas de red, donde las notificaciones del sistema no son fiables).
+- Un archivo se considera listo cuando su tamaño y fecha de modificación no cambian entre
+  dos revisiones seguidas y pasaron al menos 'espera' segundos desde la última escritura
+  (así no se lee un archivo que todavía se está copiando).
+- Los archivos listos se encolan para un único hilo de trabajo, que conserva el mismo motor
+  de escritura (y la misma instancia de Excel con xlwings) entre un archivo y otro.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+from facturacion.batch import run_batch
+
+
+logger = logging.getLogger(__name__)
+
+INTERVALO_POR_DEFECTO = 2.0   # segundos entre revisiones de las carpetas
+ESPERA_POR_DEFECTO = 3.0      # segundos sin cambios antes de procesar un archivo
+
+EXTENSIONES_ORIGEN = (".xlsx", ".xlsm")
+
+
+def _signature(path):
+    info = os.stat(path)
+    return info.st_size, info.st_mtime_ns
+
+
+def _is_readable(path):
+    """False si el archivo está bloqueado (p. ej. Excel todavía lo tiene abierto para escribir)."""
+    try:
+        with open(path, "rb"):
+            return True
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    """
+    Detecta los archivos de origen nuevos o modificados de un conjunto de carpetas.
+    scan() devuelve los que ya están listos para procesarse, una sola vez por versión.
+    """
+
+    def __init__(self, carpetas, espera=ESPERA_POR_DEFECTO, excluir=None, incluir_existentes=False):
+        self.carpetas = list(carpetas)
+        self.espera = espera
+        # Rutas que nunca se procesan (la plantilla y los archivos generados).
+        self.excluir = excluir or (lambda path: False)
+        self._vistos = {}       # ruta -> firma observada en la última revisión
+        self._procesados = {}   # ruta -> firma ya entregada para procesar
+        if not incluir_existentes:
+            for path in self._list_files():
+                try:
+                    self._procesados[path] = self._vistos[path] = _signature(path)
+                except OSError:
+                    pass
+
+    def _list_files(self):
+        for carpeta in self.carpetas:
+            try:
+                entradas = list(os.scandir(carpeta))
+            except OSError as e:
+                logger.warning("No se pudo leer la carpeta vigilada.", extra={"evento": "carpeta_error", "carpeta": carpeta, "detalle": str(e)})
+                continue
+            for entrada in entradas:
+                nombre = entrada.name
+                if (entrada.is_file() and nombre.lower().endswith(EXTENSIONES_ORIGEN)
+                        and not nombre.startswith("~$") and not self.excluir(os.path.abspath(entrada.path))):
+                    yield os.path.abspath(entrada.path)
+
+    def scan(self, ahora=None):
+        """Devuelve la lista de archivos listos (estables y legibles) desde la última revisión."""
+        ahora = time.time() if ahora is None else ahora
+        listos = []
+        actuales = {}
+        for path in self._list_files():
+            try:
+                firma = _signature(path)
+            except OSError:
+                continue  # Se borró o renombró entre el listado y la consulta.
+            actuales[path] = firma
+            if self._procesados.get(path) == firma:
+                continue
+            estable = self._vistos.get(path) == firma and ahora - firma[1] / 1e9 >= self.espera
+            if estable and _is_readable(path):
+                self._procesados[path] = firma
+                listos.append(path)
+        self._vistos = actuales
+        # Olvidar los archivos borrados, para procesarlos si vuelven a aparecer.
+        self._procesados = {path: firma for path, firma in self._procesados.items() if path in actuales}
+        return sorted(listos)
+
+
+def _worker_loop(cola, writer, processor, destino_para, template_path, cache, on_result, estado):
+    """
+    Hilo de trabajo: procesa los archivos encolados uno por uno con el mismo motor.
+    El motor se inicia y se cierra en este hilo (con xlwings, Excel pertenece al
+    apartamento COM del hilo que lo creó). Si no se puede iniciar, estado["error"] lo indica.
+    """
+    try:
+        # Iniciar el motor (Excel con xlwings) antes del primer archivo, no al recibirlo.
+        writer.start()
+    except Exception as e:
+        estado["error"] = str(e)
+        logger.error("No se pudo iniciar el motor de escritura.", extra={"evento": "motor_error", "detalle": str(e)})
+        writer.quit()
+        return
+    try:
+        while True:
+            origen = cola.get()
+            if origen is None:
+                break
+            for resultado in run_batch([(origen, destino_para(origen))], writer, processor, workers=1,
+                                       template_path=template_path, cache=cache):
+                # Tiempo desde la última modificación del archivo hasta tener la plantilla actualizada.
+                try:
+                    resultado["segundos_desde_cambio"] = round(time.time() - os.path.getmtime(origen), 3)
+                except OSError:
+                    resultado["segundos_desde_cambio"] = None
+                on_result(resultado)
+    finally:
+        try:
+            writer.close(save=False)
+        finally:
+            writer.quit()
+
+
+def watch(carpetas, writer, processor, destino_para, template_path=None, cache=None, on_result=None,
+          intervalo=INTERVALO_POR_DEFECTO, espera=ESPERA_POR_DEFECTO, incluir_existentes=False,
+          carpeta_salida=None, detener=None):
+    """
+    Vigila las carpetas hasta que se active 'detener' (threading.Event) o se interrumpa con
+    Ctrl+C. destino_para(origen) devuelve la plantilla a escribir para cada archivo y
+    on_result(resultado) recibe el resultado de cada uno (ver facturacion.batch.run_batch).
+    Se ignoran la plantilla, los destinos escritos y los archivos de 'carpeta_salida'.
+    El motor se cierra al terminar. Devuelve False si no se pudo iniciar el motor.
+    """
+    detener = detener or threading.Event()
+    on_result = on_result or (lambda resultado: None)
+    plantilla_abs = os.path.abspath(template_path) if template_path else None
+    salida_abs = os.path.abspath(carpeta_salida) if carpeta_salida else None
+    destinos = set()
+
+    def excluir(path):
+        return path == plantilla_abs or path in destinos or os.path.dirname(path) == salida_abs
+
+    def destino_registrado(origen):
+        destino = destino_para(origen)
+        destinos.add(os.path.abspath(destino))
+        return destino
+
+    watcher = FolderWatcher(carpetas, espera=espera, excluir=excluir, incluir_existentes=incluir_existentes)
+    cola = queue.Queue()
+    estado = {"error": None}
+    trabajador = threading.Thread(target=_worker_loop, name="facturacion-watcher", daemon=True,
+                                  args=(cola, writer, processor, destino_registrado, template_path, cache, on_result, estado))
+    trabajador.start()
+    logger.info("Vigilando carpetas.", extra={"evento": "vigilancia_iniciada", "carpetas": watcher.carpetas,
+                                               "intervalo": intervalo, "espera": espera})
+    try:
+        while not detener.is_set() and trabajador.is_alive():
+            for origen in watcher.scan():
+                logger.info("Archivo detectado.", extra={"evento": "archivo_detectado", "origen": origen})
+                cola.put(origen)
+            detener.wait(intervalo)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Descartar lo pendiente; el archivo en curso termina de escribirse antes de salir.
+        while True:
+            try:
+                cola.get_nowait()
+            except queue.Empty:
+                break
+        cola.put(None)
+        trabajador.join()
+        logger.info("Vigilancia terminada.", extra={"evento": "vigilancia_terminada"})
+    return estado["error"] is None
@@ -0,0 +1,487 @@
+# facturacion/writers.py
+"""
+Motores de escritura para la plantilla de destino (.xlsm).
+
+- 'openpyxl': modifica el archivo directamente (sin Excel). Es el motor por defecto
+  y funciona en servidores sin Office.
+- 'xlwings': controla una instancia de Excel invisible (requiere Office instalado).
+
+Ambos motores exponen las mismas operaciones básicas para que la lógica de
+procesamiento no dependa del motor elegido.
+"""
+import datetime
+import logging
+import threading
+
+from facturacion.controls import read_sheet_controls, read_workbook_parts, restore_sheet_controls
+
+# Dependencias opcionales: cada motor sólo necesita la suya.
+try:
+    import openpyxl
+    from openpyxl.styles import PatternFill
+    from openpyxl.styles.cell_style import StyleArray
+    from openpyxl.utils import get_column_letter
+except ImportError:
+    openpyxl = None
+    PatternFill = None
+    StyleArray = None
+    get_column_letter = None
+
+try:
+    import xlwings as xw
+except ImportError:
+    xw = None
+
+try:
+    import pythoncom  # pywin32: necesario para usar Excel (COM) desde un hilo secundario
+except ImportError:
+    pythoncom = None
+
+
+MOTOR_POR_DEFECTO = "openpyxl"
+
+logger = logging.getLogger(__name__)
+
+# Excel limita a 255 caracteres la dirección de un rango (incluidas las uniones "A2:J5,A9:J12").
+LARGO_MAX_DIRECCION = 255
+
+
+def _rgb_a_argb(rgb):
+    """Convierte una tupla (R, G, B) al formato 'FFRRGGBB' que usa openpyxl."""
+    return "FF{:02X}{:02X}{:02X}".format(*rgb)
+
+
+def _letra_columna(col):
+    """Convierte un índice de columna (1 = A) a su letra de Excel."""
+    letras = ""
+    while col > 0:
+        col, resto = divmod(col - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _direcciones_union(runs, num_cols):
+    """
+    Agrupa tramos de filas (first_row, last_row) en direcciones de rango unidas
+    ("A2:J5,A9:J12", ...) que no superen LARGO_MAX_DIRECCION.
+    """
+    ultima_col = _letra_columna(num_cols)
+    direcciones = []
+    actual = ""
+    for first_row, last_row in runs:
+        tramo = f"A{first_row}:{ultima_col}{last_row}"
+        if actual and len(actual) + 1 + len(tramo) > LARGO_MAX_DIRECCION:
+            direcciones.append(actual)
+            actual = tramo
+        else:
+            actual = f"{actual},{tramo}" if actual else tramo
+    if actual:
+        direcciones.append(actual)
+    return direcciones
+
+
+def _valor_celda(valor):
+    """Convierte NaN/NaT y tipos de pandas a valores que se pueden escribir en una celda."""
+    if valor is None:
+        return None
+    try:
+        if valor != valor:  # NaN y NaT no son iguales a sí mismos
+            return None
+    except (TypeError, ValueError):
+        return valor
+    if hasattr(valor, "to_pydatetime"):
+        return valor.to_pydatetime()
+    return valor
+
+
+class BaseWriter:
+    """
+    Interfaz común de los motores de escritura. Un mismo objeto puede abrir,
+    guardar y cerrar varios libros seguidos; quit() libera el motor al final.
+    """
+    nombre = None
+
+    def start(self):
+        """Prepara el motor antes de abrir un libro (p. ej. inicia Excel). Llamarlo de nuevo no hace nada."""
+        pass
+
+    def open(self, path):
+        raise NotImplementedError
+
+    def sheet_names(self):
+        raise NotImplementedError
+
+    def ensure_sheet(self, sheet):
+        """Crea la hoja (al final del libro) si no existe."""
+        raise NotImplementedError
+
+    def last_row(self, sheet):
+        raise NotImplementedError
+
+    def last_used_row(self, sheet):
+        """Última fila con contenido (o formato) de la hoja, sin llegar al final de la hoja."""
+        raise NotImplementedError
+
+    def read_block(self, sheet, first_row, last_row, num_cols):
+        """Lee en una sola operación los valores del bloque como lista de filas."""
+        raise NotImplementedError
+
+    def clear_block(self, sheet, first_row, last_row, num_cols):
+        """Borra valores y relleno del bloque [first_row..last_row] x [1..num_cols]."""
+        raise NotImplementedError
+
+    def clear_values(self, sheet, first_row, last_row, num_cols):
+        """Borra sólo los valores del bloque; rellenos y formatos se conservan."""
+        raise NotImplementedError
+
+    def write_rows(self, sheet, first_row, rows):
+        """Escribe una matriz de valores (filas x columnas) a partir de la columna 1."""
+        raise NotImplementedError
+
+    def shift_rows(self, sheet, moves, num_cols):
+        """
+        Inserta o elimina filas dentro del bloque de columnas [1..num_cols], desplazando hacia
+        abajo o hacia arriba lo que queda debajo (valores y formatos). moves es una lista de
+        (fila, cantidad), aplicados en orden: cantidad > 0 inserta filas vacías antes de 'fila'
+        (con el formato de la fila de arriba, como Excel); cantidad < 0 elimina esas filas.
+        """
+        raise NotImplementedError
+
+    def write_blocks(self, sheet, first_row, blocks):
+        """
+        Escribe bloques (desplazamiento, filas) a partir de first_row, consumiéndolos de uno
+        en uno: sólo un bloque de valores está en memoria a la vez.
+        """
+        for desplazamiento, filas in blocks:
+            self.write_rows(sheet, first_row + desplazamiento, filas)
+
+    def fill_rows(self, sheet, first_row, last_row, num_cols, color):
+        """Aplica un color RGB (o ninguno si color es None) a un bloque de filas."""
+        raise NotImplementedError
+
+    def fill_runs(self, sheet, runs, num_cols):
+        """
+        Aplica colores a tramos contiguos de filas. runs es una lista de
+        (first_row, last_row, color); los motores pueden agrupar los tramos de un mismo color.
+        """
+        for first_row, last_row, color in runs:
+            self.fill_rows(sheet, first_row, last_row, num_cols, color)
+
+    def set_number_format(self, sheet, first_row, last_row, col, number_format):
+        raise NotImplementedError
+
+    def autofit(self, sheet, grow_only=False):
+        """Ajusta el ancho de columnas. Con grow_only=True nunca reduce un ancho existente."""
+        raise NotImplementedError
+
+    def save(self):
+        raise NotImplementedError
+
+    def close(self, save=False):
+        raise NotImplementedError
+
+    def quit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close(save=False)
+        finally:
+            self.quit()
+        return False
+
+
+class OpenpyxlWriter(BaseWriter):
+    """
+    Motor basado en archivo: abre el .xlsm con openpyxl conservando el proyecto VBA
+    (keep_vba=True) y escribe valores, rellenos y formatos directamente en el XML del paquete.
+    openpyxl no conserva los dibujos de la hoja, así que los botones de formulario (y las
+    macros que tienen asignadas) y las partes del libro que openpyxl descarta (p. ej.
+    xl/persons/person.xml) se copian del archivo original al guardar (ver facturacion.controls).
+    """
+    nombre = "openpyxl"
+
+    def __init__(self):
+        if openpyxl is None:
+            raise ImportError("La librería openpyxl no está instalada. Instálela con: pip install openpyxl")
+        self.wb = None
+        self.path = None
+        self._fills = {}
+        self._anchos = {}
+        self._controles = {}
+        self._partes_libro = {}
+
+    def _fill_id(self, color):
+        """
+        Índice del relleno en la tabla de estilos del libro, registrado una vez por color.
+        Asignar cell.fill compara el relleno con toda la tabla en cada celda; con el índice
+        basta cambiar un entero en el estilo de la celda.
+        """
+        if color not in self._fills:
+            if color is None:
+                relleno = PatternFill(fill_type=None)
+            else:
+                argb = _rgb_a_argb(color)
+                relleno = PatternFill(fill_type="solid", start_color=argb, end_color=argb)
+            self._fills[color] = self.wb._fills.add(relleno)
+        return self._fills[color]
+
+    def _set_fill(self, ws, first_row, last_row, num_cols, color):
+        id_relleno = self._fill_id(color)
+        for row in ws.iter_rows(min_row=first_row, max_row=last_row, max_col=num_cols):
+            for cell in row:
+                # Igual que el descriptor de estilos de openpyxl: las celdas nuevas no tienen estilo propio.
+                if not cell._style:
+                    cell._style = StyleArray()
+                cell._style.fillId = id_relleno
+
+    def open(self, path):
+        self.path = path
+        self.wb = openpyxl.load_workbook(path, keep_vba=path.lower().endswith(".xlsm"))
+        self._fills = {}
+        self._anchos = {}
+        # Leídos antes de escribir nada: save() sobrescribe el mismo archivo.
+        self._controles = read_sheet_controls(path)
+        self._partes_libro = read_workbook_parts(path)
+
+    def sheet_names(self):
+        return list(self.wb.sheetnames)
+
+    def ensure_sheet(self, sheet):
+        if sheet not in self.wb.sheetnames:
+            self.wb.create_sheet(sheet)
+
+    def last_row(self, sheet):
+        return self.wb[sheet].max_row
+
+    def last_used_row(self, sheet):
+        return self.wb[sheet].max_row
+
+    def read_block(self, sheet, first_row, last_row, num_cols):
+        return [list(fila) for fila in self.wb[sheet].iter_rows(min_row=first_row, max_row=last_row,
+                                                                 max_col=num_cols, values_only=True)]
+
+    def clear_block(self, sheet, first_row, last_row, num_cols):
+        self.clear_values(sheet, first_row, last_row, num_cols)
+        self._set_fill(self.wb[sheet], first_row, last_row, num_cols, None)
+
+    def clear_values(self, sheet, first_row, last_row, num_cols):
+        ws = self.wb[sheet]
+        for row in ws.iter_rows(min_row=first_row, max_row=last_row, max_col=num_cols):
+            for cell in row:
+                cell.value = None
+
+    def write_rows(self, sheet, first_row, rows):
+        ws = self.wb[sheet]
+        anchos = self._anchos.setdefault(sheet, {})
+        for r_offset, fila in enumerate(rows):
+            r_idx = first_row + r_offset
+            for c_idx, valor in enumerate(fila, start=1):
+                valor = _valor_celda(valor)
+                # ws.cell(..., value=None) no borra la celda; se asigna explícitamente.
+                ws.cell(row=r_idx, column=c_idx).value = valor
+                if valor is not None:
+                    largo = 10 if isinstance(valor, (datetime.date, datetime.datetime)) else len(str(valor))
+                    if largo > anchos.get(c_idx, 0):
+                        anchos[c_idx] = largo
+
+    def shift_rows(self, sheet, moves, num_cols):
+        # Todos los movimientos en una sola pasada: primero se calcula de qué fila original
+        # viene cada fila final y después cada celda se reubica una sola vez (ws.move_range
+        # recorrería el resto de la hoja en cada movimiento).
+        if not moves:
+            return
+        ws = self.wb[sheet]
+        primera = min(fila for fila, _ in moves)
+        # origen[k]: fila original que queda en la fila primera + k (None = insertada, 0 = vacía).
+        origen = list(range(primera, ws.max_row + 1))
+        for fila, cantidad in moves:
+            posicion = fila - primera
+            if posicion > len(origen):
+                origen += [0] * (posicion - len(origen))
+            if cantidad > 0:
+                origen[posicion:posicion] = [None] * cantidad
+            else:
+                del origen[posicion:posicion - cantidad]
+        destino = {fila: primera + k for k, fila in enumerate(origen) if fila}
+
+        celdas = [ws._cells.pop(clave) for clave in [clave for clave in ws._cells
+                                                      if clave[0] >= primera and clave[1] <= num_cols]]
+        for cell in celdas:
+            if cell.row in destino:
+                cell.row = destino[cell.row]
+                ws._cells[(cell.row, cell.column)] = cell
+        # Las filas insertadas toman el estilo de la fila de arriba (bordes, fuentes...), como en Excel.
+        for k, fila in enumerate(origen):
+            if fila is None:
+                for c_idx in range(1, num_cols + 1):
+                    arriba = ws._cells.get((primera + k - 1, c_idx))
+                    if arriba is not None and arriba.has_style:
+                        ws.cell(row=primera + k, column=c_idx)._style = StyleArray(arriba._style)
+
+    def fill_rows(self, sheet, first_row, last_row, num_cols, color):
+        self._set_fill(self.wb[sheet], first_row, last_row, num_cols, color)
+
+    def set_number_format(self, sheet, first_row, last_row, col, number_format):
+        ws = self.wb[sheet]
+        for (cell,) in ws.iter_rows(min_row=first_row, max_row=last_row, min_col=col, max_col=col):
+            cell.number_format = number_format
+
+    def autofit(self, sheet, grow_only=False):
+        # Aproximación del autoajuste de Excel: ancho según el texto más largo escrito
+        # (incluido el encabezado de la fila 1).
+        ws = self.wb[sheet]
+        for c_idx, largo in self._anchos.get(sheet, {}).items():
+            encabezado = ws.cell(row=1, column=c_idx).value
+            if encabezado is not None:
+                largo = max(largo, len(str(encabezado)))
+            dimension = ws.column_dimensions[get_column_letter(c_idx)]
+            ancho = min(largo + 2, 80)
+            if grow_only and dimension.width and dimension.width >= ancho:
+                continue
+            dimension.width = ancho
+
+    def save(self):
+        self.wb.save(self.path)
+        omitidas = restore_sheet_controls(self.path, self._controles, self._partes_libro)
+        if omitidas:
+            logger.warning("No se pudieron conservar los botones de las hojas %s.", ", ".join(omitidas))
+
+    def close(self, save=False):
+        if self.wb is not None:
+            if save:
+                self.save()
+            self.wb.close()
+        self.wb = None
+
+
+class XlwingsWriter(BaseWriter):
+    """
+    Motor basado en Excel (xlwings). La instancia de Excel se abre una sola vez y se
+    reutiliza para todos los libros hasta llamar a quit().
+    """
+    nombre = "xlwings"
+
+    def __init__(self):
+        if xw is None:
+            raise ImportError("La librería xlwings no está instalada. Instálela con: pip install xlwings")
+        self.app = None
+        self.wb = None
+        self._com_iniciado = False
+
+    def _ensure_app(self):
+        if pythoncom is not None and not self._com_iniciado and threading.current_thread() is not threading.main_thread():
+            pythoncom.CoInitialize()
+            self._com_iniciado = True
+        if self.app is None or not self.app.alive:
+            # Abrir Excel de forma INVISIBLE
+            self.app = xw.App(visible=False)
+            self.app.api.DisplayAlerts = False
+            self.app.api.ScreenUpdating = False
+            self.app.api.Calculation = xw.constants.Calculation.xlCalculationManual
+        return self.app
+
+    def start(self):
+        self._ensure_app()
+
+    def open(self, path):
+        self.wb = self._ensure_app().books.open(path)
+
+    def sheet_names(self):
+        return [s.name for s in self.wb.sheets]
+
+    def ensure_sheet(self, sheet):
+        if sheet not in self.sheet_names():
+            self.wb.sheets.add(sheet, after=self.wb.sheets[-1])
+
+    def last_row(self, sheet):
+        return self.wb.sheets[sheet].cells.last_cell.row
+
+    def last_used_row(self, sheet):
+        return self.wb.sheets[sheet].used_range.last_cell.row
+
+    def read_block(self, sheet, first_row, last_row, num_cols):
+        return self.wb.sheets[sheet].range((first_row, 1), (last_row, num_cols)).options(ndim=2).value
+
+    def clear_block(self, sheet, first_row, last_row, num_cols):
+        rango = self.wb.sheets[sheet].range((first_row, 1), (last_row, num_cols))
+        rango.clear_contents()
+        rango.color = xw.constants.ColorIndex.xlColorIndexNone
+
+    def clear_values(self, sheet, first_row, last_row, num_cols):
+        self.wb.sheets[sheet].range((first_row, 1), (last_row, num_cols)).clear_contents()
+
+    def write_rows(self, sheet, first_row, rows):
+        self.wb.sheets[sheet].range(first_row, 1).value = rows
+
+    def shift_rows(self, sheet, moves, num_cols):
+        # Una llamada a Excel por movimiento; Excel desplaza el resto de la hoja.
+        ws = self.wb.sheets[sheet]
+        for fila, cantidad in moves:
+            rango = ws.range((fila, 1), (fila + abs(cantidad) - 1, num_cols))
+            if cantidad > 0:
+                rango.insert(shift="down", copy_origin="format_from_left_or_above")
+            else:
+                rango.delete(shift="up")
+
+    def fill_rows(self, sheet, first_row, last_row, num_cols, color):
+        rango = self.wb.sheets[sheet].range((first_row, 1), (last_row, num_cols))
+        rango.color = color if color else xw.constants.ColorIndex.xlColorIndexNone
+
+    def fill_runs(self, sheet, runs, num_cols):
+        # Una sola llamada COM por cada unión de rangos del mismo color,
+        # en lugar de una por fila.
+        por_color = {}
+        for first_row, last_row, color in runs:
+            por_color.setdefault(color, []).append((first_row, last_row))
+        ws = self.wb.sheets[sheet]
+        for color, tramos in por_color.items():
+            for direccion in _direcciones_union(tramos, num_cols):
+                ws.range(direccion).color = color if color else xw.constants.ColorIndex.xlColorIndexNone
+
+    def set_number_format(self, sheet, first_row, last_row, col, number_format):
+        self.wb.sheets[sheet].range((first_row, col), (last_row, col)).number_format = number_format
+
+    def autofit(self, sheet, grow_only=False):
+        # Excel considera todas las celdas de la columna, así que grow_only no hace falta aquí.
+        self.wb.sheets[sheet].autofit()
+
+    def save(self):
+        self.wb.save()
+
+    def close(self, save=False):
+        if self.wb is not None:
+            if save:
+                self.save()
+            self.wb.close()
+        self.wb = None
+
+    def quit(self):
+        if self.app is not None and self.app.alive:
+            for open_wb in self.app.books:
+                try:
+                    open_wb.close()
+                except Exception:
+                    pass
+            self.app.quit()
+        self.app = None
+        if self._com_iniciado:
+            pythoncom.CoUninitialize()
+            self._com_iniciado = False
+
+
+WRITERS = {
+    OpenpyxlWriter.nombre: OpenpyxlWriter,
+    XlwingsWriter.nombre: XlwingsWriter,
+}
+
+
+def create_writer(motor=MOTOR_POR_DEFECTO):
+    """Crea el motor de escritura indicado ('openpyxl' o 'xlwings')."""
+    try:
+        return WRITERS[motor]()
+    except KeyError:
+        raise ValueError(f"Motor de escritura desconocido: '{motor}'. Opciones: {', '.join(WRITERS)}")
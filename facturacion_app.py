@@ -1,31 +1,77 @@
-# facturacion_app.py (Usando xlwings)
-import pandas as pd
-import xlwings as xw
-from tkinter import Tk, filedialog, messagebox, StringVar, ttk, Label
+# facturacion_app.py
+from tkinter import Tk, filedialog, messagebox, StringVar, BooleanVar, ttk, Label, PhotoImage
 import os
 import datetime
 import sys
 import subprocess
+import threading
+import queue
 
-# Importar Image y ImageTk para manejar imágenes en Tkinter
-try:
-    from PIL import Image, ImageTk
-except ImportError:
-    messagebox.showwarning("Advertencia", "La librería Pillow no está instalada. No se podrá mostrar el logo. "
-                                         "Por favor, instala Pillow con: pip install Pillow")
-    Image = None
-    ImageTk = None
+# La lógica de procesamiento (pandas, openpyxl, xlwings) no se importa aquí: cargarla tarda
+# más que mostrar la ventana. Se precarga en segundo plano una vez visible la ventana, y el
+# procesamiento la importa (o la espera, si la precarga no terminó) al empezar.
+MODULOS_PRECARGA = ("facturacion.processor", "facturacion.writers", "facturacion.tracing")
 
+# Logo ya redimensionado, guardado junto al .ico (o en la carpeta del usuario) para no
+# decodificarlo y escalarlo en cada inicio.
+TAMANO_LOGO = (64, 64)
+ARCHIVO_LOGO_CACHE = "logo_64.png"
+
+
+def _prewarm_imports():
+    """Importa los módulos de procesamiento (se ejecuta en un hilo en segundo plano)."""
+    import importlib
+    for modulo in MODULOS_PRECARGA:
+        try:
+            importlib.import_module(modulo)
+        except Exception as e:
+            # El error real se mostrará al procesar; aquí sólo se adelanta la carga.
+            print(f"WARNING: No se pudo precargar '{modulo}': {e}", file=sys.stderr)
+
+
+def _logo_cache_dirs(logo_path):
+    """Carpetas donde se guarda el logo redimensionado: junto al .ico y, si no se puede, la del usuario."""
+    from facturacion.cache import default_cache_dir
+    return [os.path.dirname(logo_path), default_cache_dir()]
+
+
+def _load_logo(master, logo_path):
+    """
+    Devuelve el logo redimensionado como imagen de Tk. El PNG se genera con Pillow una sola vez
+    (o cuando el .ico es más reciente) junto al .ico o, si esa carpeta es de sólo lectura
+    (p. ej. Archivos de programa), en la carpeta del usuario; en los inicios siguientes Tk lo lee
+    directamente, sin Pillow. Si no se puede guardar en ninguna, se usa la imagen en memoria.
+    Devuelve None si Pillow no está instalado y no hay PNG guardado.
+    """
+    for carpeta in _logo_cache_dirs(logo_path):
+        cache_path = os.path.join(carpeta, ARCHIVO_LOGO_CACHE)
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(logo_path):
+            return PhotoImage(master=master, file=cache_path)
+    try:
+        from PIL import Image, ImageTk
+    except ImportError:
+        messagebox.showwarning("Advertencia", "La librería Pillow no está instalada. No se podrá mostrar el logo. "
+                                             "Por favor, instala Pillow con: pip install Pillow")
+        return None
+    img = Image.open(logo_path)
+    img_display = img.resize(TAMANO_LOGO, Image.Resampling.LANCZOS)
+    for carpeta in _logo_cache_dirs(logo_path):
+        cache_path = os.path.join(carpeta, ARCHIVO_LOGO_CACHE)
+        try:
+            os.makedirs(carpeta, exist_ok=True)
+            img_display.save(cache_path, format="PNG")
+        except OSError as e:
+            print(f"WARNING: No se pudo guardar el logo en caché ({cache_path}): {e}", file=sys.stderr)
+            continue
+        return PhotoImage(master=master, file=cache_path)
+    return ImageTk.PhotoImage(img_display, master=master)
 
-# Definiciones de colores para xlwings (para relleno de filas)
-COLOR_ELVIRA_RGB = (102, 255, 255)   # #66FFFF (Cian/Azul Claro)
-COLOR_CARLOS_RGB = (204, 255, 153)   # #CCFF99 (Verde/Amarillo Claro)
 
 class FacturacionProcessorApp:
     def __init__(self, master):
         self.master = master
         master.title("Procesador de Pronóstico de Cobranza")
-        master.geometry("700x550") # Aumentar un poco la altura para el logo y más espacio
+        master.geometry("700x600") # Aumentar un poco la altura para el logo, el progreso y más espacio
         master.resizable(False, False)
 
         # Configurar el tema de ttk para una apariencia más moderna
@@ -47,26 +93,23 @@ class FacturacionProcessorApp:
         self.excel_template_path = StringVar()
         self.excel_template_path.set("Ningún archivo de plantilla seleccionado")
 
-        self.HOJA_ORIGEN = "TABLA (OK)"
-        self.OVL_HOJA = "FACTURACION OVL"
-        self.LFOV_HOJA = "FACTURACION LFOV"
-        self.FILA_INICIO_ENCABEZADOS_ORIGEN = 7
-        self.FILA_INICIO_DATOS_DESTINO = 2
-
-        # Define las columnas a importar y sus nombres en el archivo de destino.
-        self.COLUMNAS_ORIGEN_ORDENADAS = {
-            'EMISOR': 'EMISOR',
-            'NOMBRE O RAZON SOCIAL': 'NOMBRE O RAZON SOCIAL',
-            'TIPO DE DOCUMENTO': 'TIPO DE DOCUMENTO',
-            'CONCEPTO': 'CONCEPTO',
-            'FOLIO': 'FOLIO',
-            'CONTRATO': 'CONTRATO',
-            'PERIODO \nDE \nRENTA': 'PERIODO DE RENTA',
-            'SALDO \nPENDIENTE': 'SALDO PENDIENTE',
-            'FECHA DE PAGO': 'FECHA DE PAGO',
-            'AGENTE': 'AGENTE'
-        }
-        self.TIPOS_DOCUMENTO_INCLUIDOS = ['FACTURA', 'NOTA DE CREDITO', 'SALDO A FAVOR', 'RECIBO DE PAGO']
+        # Lógica de procesamiento (lectura, filtros, intercalado y escritura de la plantilla).
+        # Se crea en el primer procesamiento, ver _ensure_processor().
+        self.processor = None
+
+        # El procesamiento corre en un hilo aparte; los eventos vuelven a Tk por esta cola.
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+        self.INTERVALO_SONDEO_MS = 100
+        # Motor de escritura de la plantilla: 'xlwings' (Excel instalado) mientras la casilla esté
+        # marcada, que es lo predeterminado (el comportamiento de siempre); si se desmarca,
+        # MOTOR_ESCRITURA (None = el motor por defecto de facturacion.writers, openpyxl sin Excel).
+        self.MOTOR_ESCRITURA = None
+        self.usar_excel = BooleanVar(value=True)
+        # Si se indica (variable de entorno FACTURACION_REPORTE), cada procesamiento guarda en
+        # ese archivo JSON el tiempo, las filas y la memoria de cada fase.
+        self.RUTA_REPORTE = os.environ.get("FACTURACION_REPORTE")
 
         # Configuración de la cuadrícula
         self.master.columnconfigure(0, weight=1)
@@ -78,16 +121,15 @@ class FacturacionProcessorApp:
         self.logo_image = None
         self.logo_label = None
         logo_path = os.path.join(os.path.dirname(__file__), "logo.ico")
-        if Image and ImageTk and os.path.exists(logo_path):
+        if os.path.exists(logo_path):
             try:
                 master.wm_iconbitmap(logo_path)
 
-                img = Image.open(logo_path)
-                img_display = img.resize((64, 64), Image.Resampling.LANCZOS)
-                self.logo_image = ImageTk.PhotoImage(img_display)
-                self.logo_label = Label(master, image=self.logo_image)
-                self.logo_label.grid(row=0, column=0, columnspan=2, pady=(10, 5), sticky='n')
-                
+                self.logo_image = _load_logo(master, logo_path)
+                if self.logo_image is not None:
+                    self.logo_label = Label(master, image=self.logo_image)
+                    self.logo_label.grid(row=0, column=0, columnspan=2, pady=(10, 5), sticky='n')
+
             except Exception as e:
                 messagebox.showwarning("Advertencia de Logo/Ícono", f"No se pudo cargar el logo/ícono: {e}. Asegúrese de que 'logo.ico' es un archivo de ícono válido y que Pillow está instalado.")
                 self.logo_image = None
@@ -116,17 +158,41 @@ class FacturacionProcessorApp:
         ttk.Label(master, text="3. Haga clic para PROCESAR y ACTUALIZAR la PLANTILLA:",
                   font=('Arial', 10, 'bold')).grid(row=current_row, column=0, columnspan=2, pady=(15, 5), sticky='w', padx=20)
         current_row += 1
-        self.process_button = ttk.Button(master, text="Procesar y Actualizar Plantilla de Cobranza", command=self.process_excel)
-        self.process_button.grid(row=current_row, column=0, columnspan=2, pady=10)
+        self.usar_excel_check = ttk.Checkbutton(master, text="Usar Microsoft Excel para escribir la plantilla (desmarcar para escribir sin Excel)",
+                                                variable=self.usar_excel)
+        self.usar_excel_check.grid(row=current_row, column=0, columnspan=2, pady=(0, 5))
+        current_row += 1
+        botones = ttk.Frame(master)
+        botones.grid(row=current_row, column=0, columnspan=2, pady=10)
+        self.process_button = ttk.Button(botones, text="Procesar y Actualizar Plantilla de Cobranza", command=self.process_excel)
+        self.process_button.pack(side='left', padx=5)
+        self.cancel_button = ttk.Button(botones, text="Cancelar", command=self.cancel_processing, state='disabled')
+        self.cancel_button.pack(side='left', padx=5)
         
         current_row += 1
         ttk.Label(master, text="La PLANTILLA seleccionada será MODIFICADA directamente con los datos procesados.",
                   font=('Arial', 9), foreground="red").grid(row=current_row, column=0, columnspan=2, pady=(0, 10))
 
+        current_row += 1
+        self.progress_bar = ttk.Progressbar(master, orient='horizontal', mode='determinate', maximum=100)
+        self.progress_bar.grid(row=current_row, column=0, columnspan=2, sticky='ew', padx=20)
+
         current_row += 1
         self.status_label = ttk.Label(master, text="Listo para iniciar. Seleccione los archivos.", font=('Arial', 9, 'italic'))
         self.status_label.grid(row=current_row, column=0, columnspan=2, pady=(10, 20))
 
+        # Precargar la lógica de procesamiento cuando la ventana ya está dibujada.
+        master.after_idle(lambda: threading.Thread(target=_prewarm_imports, daemon=True).start())
+
+    def _ensure_processor(self):
+        """Crea el procesador en el primer uso (importa pandas y los motores de escritura)."""
+        if self.processor is None:
+            from facturacion.processor import FacturacionProcessor
+            processor = FacturacionProcessor()
+            processor.progress_callback = self._on_progress
+            self.processor = processor
+        return self.processor
+
     def browse_origin_file(self):
         file_selected = filedialog.askopenfilename(
             initialdir=os.path.expanduser("~"),
@@ -153,132 +219,6 @@ class FacturacionProcessorApp:
             self.excel_template_path.set("Ningún archivo de plantilla seleccionado")
             self.status_label.config(text="Selección de archivo de plantilla cancelada.")
 
-    def _interleave_agents(self, df_input):
-        """
-        Intercala los grupos de clientes de 'ELVIRA' y 'CARLOS' para su presentación.
-        """
-        if df_input.empty:
-            return df_input
-
-        df_input['AGENTE_UPPER_TEMP'] = df_input['AGENTE'].astype(str).str.strip().str.upper()
-
-        df_elvira_all = df_input[df_input['AGENTE_UPPER_TEMP'] == 'ELVIRA'].copy()
-        df_carlos_all = df_input[df_input['AGENTE_UPPER_TEMP'] == 'CARLOS'].copy()
-
-        elvira_client_groups = [group.drop(columns=['AGENTE_UPPER_TEMP']) for _, group in df_elvira_all.groupby('NOMBRE O RAZON SOCIAL', sort=True)]
-        carlos_client_groups = [group.drop(columns=['AGENTE_UPPER_TEMP']) for _, group in df_carlos_all.groupby('NOMBRE O RAZON SOCIAL', sort=True)] 
-
-        interleaved_dataframes = []
-        
-        iter_elvira_groups = iter(elvira_client_groups)
-        iter_carlos_groups = iter(carlos_client_groups)
-
-        while True:
-            el_group = None
-            ca_group = None
-            try:
-                el_group = next(iter_elvira_groups)
-            except StopIteration:
-                pass
-
-            try:
-                ca_group = next(iter_carlos_groups)
-            except StopIteration:
-                pass
-            
-            if el_group is not None:
-                interleaved_dataframes.append(el_group)
-            if ca_group is not None:
-                interleaved_dataframes.append(ca_group)
-            
-            if el_group is None and ca_group is None:
-                break
-        
-        if interleaved_dataframes:
-            return pd.concat(interleaved_dataframes, ignore_index=True)
-        else:
-            return pd.DataFrame(columns=[col for col in df_input.columns if col != 'AGENTE_UPPER_TEMP'])
-
-
-    def _process_single_sheet(self, ws_sheet, df_sheet):
-        """
-        Procesa una única hoja (OVL o LFOV) utilizando xlwings.
-        Limpia datos, escribe nuevos datos y aplica formatos básicos (colores y fechas).
-        La lógica de inserción de filas, bordes y validación se deja a VBA.
-        """
-        try:
-            num_output_cols = len(self.COLUMNAS_ORIGEN_ORDENADAS) 
-            
-            last_row_in_sheet = ws_sheet.cells.last_cell.row
-            if last_row_in_sheet >= self.FILA_INICIO_DATOS_DESTINO:
-                ws_sheet.range((self.FILA_INICIO_DATOS_DESTINO, 1), (last_row_in_sheet, num_output_cols)).clear_contents()
-                ws_sheet.range((self.FILA_INICIO_DATOS_DESTINO, 1), (last_row_in_sheet, num_output_cols)).color = xw.constants.ColorIndex.xlColorIndexNone 
-                
-            # --- Manejo de NaT (Not a Time) en 'FECHA DE PAGO' antes de escribir a Excel ---
-            if 'FECHA DE PAGO' in df_sheet.columns:
-                # Convertir NaT (valores de fecha no válidos) a None, que xlwings escribe como celdas vacías.
-                # Esto evita que 'NaT' se escriba como texto y cause problemas de formato en Excel.
-                df_sheet['FECHA DE PAGO'] = df_sheet['FECHA DE PAGO'].apply(lambda x: None if pd.isna(x) else x)
-
-            # Escribir los datos procesados (DataFrame a Excel)
-            if not df_sheet.empty:
-                ws_sheet.range(self.FILA_INICIO_DATOS_DESTINO, 1).value = df_sheet.values
-            
-            last_data_row_written = self.FILA_INICIO_DATOS_DESTINO + df_sheet.shape[0] - 1
-            if df_sheet.empty:
-                last_data_row_written = self.FILA_INICIO_DATOS_DESTINO - 1 
-
-            # Obtener índices de columna para formatos y lógica
-            agente_col_idx = list(df_sheet.columns).index('AGENTE') if 'AGENTE' in df_sheet.columns else -1
-            folio_col_idx = list(df_sheet.columns).index('FOLIO') if 'FOLIO' in df_sheet.columns else -1
-            fecha_pago_col_idx = list(df_sheet.columns).index('FECHA DE PAGO') if 'FECHA DE PAGO' in df_sheet.columns else -1
-            
-            agente_col_excel = agente_col_idx + 1 if agente_col_idx != -1 else -1
-            folio_col_excel = folio_col_idx + 1 if folio_col_idx != -1 else -1
-            fecha_pago_col_excel = fecha_pago_col_idx + 1 if fecha_pago_col_idx != -1 else -1
-
-            # Aplica formato de colores (Elvira/Carlos) a todas las columnas importadas.
-            if last_data_row_written >= self.FILA_INICIO_DATOS_DESTINO:
-                cols_for_agent_coloring = num_output_cols
-
-                for r_idx in range(self.FILA_INICIO_DATOS_DESTINO, last_data_row_written + 1):
-                    row_fill_color = None
-                    
-                    cell_agente_value = str(ws_sheet.cells(r_idx, agente_col_excel).value).strip().upper() if agente_col_excel != -1 else ""
-                    cell_folio_value = str(ws_sheet.cells(r_idx, folio_col_excel).value).strip().upper() if folio_col_excel != -1 else ""
-
-                    if cell_agente_value == "ELVIRA":
-                        row_fill_color = COLOR_ELVIRA_RGB
-                    elif cell_agente_value == "CARLOS":
-                        row_fill_color = COLOR_CARLOS_RGB
-
-                    if row_fill_color is None:
-                        if cell_folio_value == "ELVIRA": 
-                            row_fill_color = COLOR_ELVIRA_RGB
-                        elif cell_folio_value == "CARLOS":
-                            row_fill_color = COLOR_CARLOS_RGB
-
-                    # Aplicar color de fondo a las columnas importadas
-                    if row_fill_color:
-                        ws_sheet.range((r_idx, 1), (r_idx, cols_for_agent_coloring)).color = row_fill_color
-                    else:
-                        ws_sheet.range((r_idx, 1), (r_idx, cols_for_agent_coloring)).color = xw.constants.ColorIndex.xlColorIndexNone 
-                    
-                # --- Aplicar formato de Fecha a toda la columna 'FECHA DE PAGO' después de escribir los datos ---
-                if fecha_pago_col_excel != -1 and last_data_row_written >= self.FILA_INICIO_DATOS_DESTINO:
-                    # Define el rango para la columna 'FECHA DE PAGO'
-                    date_column_range = ws_sheet.range((self.FILA_INICIO_DATOS_DESTINO, fecha_pago_col_excel), (last_data_row_written, fecha_pago_col_excel))
-                    # Aplica el formato de fecha robusto
-                    date_column_range.number_format = 'DD/MM/YYYY'
-                        
-            # Ajustar ancho de columnas automáticamente
-            ws_sheet.autofit()
-
-        except Exception as e:
-            print(f"ERROR en _process_single_sheet para hoja '{ws_sheet.name}': {e}", file=sys.stderr)
-            raise
-
-
     def process_excel(self):
         origin_path = self.excel_origin_path.get()
         template_path = self.excel_template_path.get()
@@ -293,155 +233,141 @@ class FacturacionProcessorApp:
             self.status_label.config(text="Error: Archivo de plantilla no encontrado.")
             return
 
-        app = None
-        wb = None
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.cancel_event.clear()
+        self._set_processing(True)
+        self.progress_bar['value'] = 0
+        self.status_label.config(text="Procesando datos. Por favor, espere...")
+
+        # Motor de escritura (openpyxl por defecto; xlwings si se pidió usar Excel)
+        motor = 'xlwings' if self.usar_excel.get() else self.MOTOR_ESCRITURA
+        self.worker = threading.Thread(target=self._process_worker, args=(origin_path, template_path, motor), daemon=True)
+        self.worker.start()
+        self.master.after(self.INTERVALO_SONDEO_MS, self._poll_events)
+
+    def cancel_processing(self):
+        self.cancel_event.set()
+        self.cancel_button.config(state='disabled')
+        self.status_label.config(text="Cancelando... se detendrá al terminar la fase actual.")
+
+    def _set_processing(self, activo):
+        """Habilita/deshabilita los controles mientras hay un procesamiento en curso."""
+        estado = 'disabled' if activo else 'normal'
+        for control in (self.process_button, self.browse_origin_button, self.browse_template_button, self.usar_excel_check):
+            control.config(state=estado)
+        self.cancel_button.config(state='normal' if activo else 'disabled')
+
+    def _on_progress(self, paso, total, descripcion, filas):
+        # Se llama desde el hilo de trabajo: no tocar widgets aquí, sólo encolar.
+        from facturacion.processor import ProcesamientoCancelado
+        if self.cancel_event.is_set():
+            raise ProcesamientoCancelado()
+        self.events.put(('progreso', paso, total, descripcion, filas))
+
+    def _process_worker(self, origin_path, template_path, motor):
+        """Lectura, filtrado y escritura de la plantilla, en el hilo de trabajo."""
+        # Primer uso: si la precarga no terminó, la importación espera a que termine.
+        from facturacion.processor import FacturacionError, ProcesamientoCancelado
+        from facturacion.writers import create_writer, MOTOR_POR_DEFECTO
+        from facturacion.tracing import RunReport
+
+        motor = motor or MOTOR_POR_DEFECTO
+        writer = None
         processed_successfully = False
-        
+        self._ensure_processor().report = RunReport() if self.RUTA_REPORTE else None
+
         try:
-            self.status_label.config(text="Procesando datos. Por favor, espere...")
-            self.master.update_idletasks()
-            
-            # Abrir Excel de forma INVISIBLE
-            app = xw.App(visible=False) 
-            app.api.DisplayAlerts = False
-            app.api.ScreenUpdating = False
-            app.api.Calculation = xw.constants.Calculation.xlCalculationManual
+            writer = create_writer(motor)
 
             # Parte 1: Lectura y procesamiento del archivo de origen con Pandas
-            df_origen_con_headers = pd.read_excel(origin_path, sheet_name=self.HOJA_ORIGEN,
-                                                 header=self.FILA_INICIO_ENCABEZADOS_ORIGEN - 1)
-
-            # --- Asegurarse de que 'FECHA DE PAGO' sea tipo datetime ANTES de procesar ---
-            if 'FECHA DE PAGO' in df_origen_con_headers.columns:
-                # Convertir a datetime, forzando errores a NaT (Not a Time)
-                df_origen_con_headers['FECHA DE PAGO'] = pd.to_datetime(df_origen_con_headers['FECHA DE PAGO'], errors='coerce')
-            # --- Fin de la mejora de fecha ---
-
-
-            required_cols_origin = list(self.COLUMNAS_ORIGEN_ORDENADAS.keys())
-            for col in required_cols_origin:
-                if col not in df_origen_con_headers.columns:
-                    messagebox.showerror("Error de Columna en Origen", f"La columna '{col}' no fue encontrada en la hoja '{self.HOJA_ORIGEN}' del archivo de origen. "
-                                                                        f"Asegúrese de que el encabezado en la fila {self.FILA_INICIO_ENCABEZADOS_ORIGEN} sea exactamente '{col}'.", parent=self.master)
-                    self.status_label.config(text=f"Error: Columna '{col}' no encontrada en origen.")
-                    return 
-
-            df_origen_con_headers['EMISOR_LIMPIO'] = df_origen_con_headers['EMISOR'].astype(str).str.strip().str.upper()
-
-            df_filtrado_emisor = df_origen_con_headers[
-                df_origen_con_headers['EMISOR_LIMPIO'].isin(['OVL', 'LFOV'])
-            ].copy()
-
-            if 'EMISOR_LIMPIO' in df_filtrado_emisor.columns:
-                df_filtrado_emisor = df_filtrado_emisor.drop(columns=['EMISOR_LIMPIO'])
-            
-            df_filtrado_documento = df_filtrado_emisor.copy()
-
-            if 'TIPO DE DOCUMENTO' not in df_filtrado_emisor.columns:
-                messagebox.showerror("Error de Columna", f"La columna 'TIPO DE DOCUMENTO' no fue encontrada en el DataFrame filtrado por EMISOR. "
-                                                        "Verifique el archivo de origen y la configuración de columnas.", parent=self.master)
-                self.status_label.config(text=f"Error: Columna 'TIPO DE DOCUMENTO' no encontrada para filtrar.")
-                return
-
-            df_filtrado_documento = df_filtrado_emisor[
-                df_filtrado_emisor['TIPO DE DOCUMENTO'].astype(str).str.strip().str.upper().isin(self.TIPOS_DOCUMENTO_INCLUIDOS)
-            ].copy()
-
-            saldo_pendiente_col_name_original = 'SALDO \nPENDIENTE' 
-            if saldo_pendiente_col_name_original in df_filtrado_documento.columns:
-                pd.to_numeric(df_filtrado_documento[saldo_pendiente_col_name_original], errors='coerce') 
-                df_filtrado_final = df_filtrado_documento.copy() 
-            else:
-                messagebox.showwarning("Advertencia de Columna", f"La columna '{saldo_pendiente_col_name_original}' no fue encontrada después de los filtros anteriores. "
-                                                                 "No se pudo verificar el tipo de dato de SALDO PENDIENTE, pero se procederá con los filtros existentes.", parent=self.master)
-                df_filtrado_final = df_filtrado_documento.copy()
-
-            columnas_a_seleccionar = []
-            for col_original in self.COLUMNAS_ORIGEN_ORDENADAS.keys():
-                if col_original in df_filtrado_final.columns: 
-                    columnas_a_seleccionar.append(col_original)
-                else:
-                    pass
-
-            if not columnas_a_seleccionar:
-                messagebox.showwarning("Advertencia", "No se encontraron filas que cumplan los criterios de filtro (EMISOR OVL/LFOV o TIPO DE DOCUMENTO) en el archivo de origen. El archivo de salida estará vacío.", parent=self.master)
-                self.status_label.config(text="Advertencia: No se encontraron datos para procesar.")
-                df_final_empty_cols = list(self.COLUMNAS_ORIGEN_ORDENADAS.values())
-                df_ovl = pd.DataFrame(columns=df_final_empty_cols)
-                df_lfov = pd.DataFrame(columns=df_final_empty_cols)
-            else:
-                df_final_processed = df_filtrado_final[columnas_a_seleccionar].rename(columns=self.COLUMNAS_ORIGEN_ORDENADAS)
-                
-                df_ovl_raw = df_final_processed[df_final_processed['EMISOR'].astype(str).str.strip().str.upper() == 'OVL'].copy()
-                df_ovl = self._interleave_agents(df_ovl_raw)
-
-                df_lfov_raw = df_final_processed[df_final_processed['EMISOR'].astype(str).str.strip().str.upper() == 'LFOV'].copy()
-                df_lfov = self._interleave_agents(df_lfov_raw)
-
-            # Parte 2: Carga y preparación de la plantilla de destino con xlwings
-            wb = app.books.open(template_path)
-
-            if self.OVL_HOJA not in [s.name for s in wb.sheets]:
-                messagebox.showerror("Error en Plantilla", f"La hoja '{self.OVL_HOJA}' no fue encontrada en el archivo de plantilla. Asegúrese de que el nombre sea correcto.", parent=self.master)
-                return 
-
-            if self.LFOV_HOJA not in [s.name for s in wb.sheets]:
-                messagebox.showerror("Error en Plantilla", f"La hoja '{self.LFOV_HOJA}' no fue encontrada en el archivo de plantilla. Asegúrese de que el nombre sea correcto.", parent=self.master)
-                return 
-
-            ws_ovl = wb.sheets[self.OVL_HOJA]
-            ws_lfov = wb.sheets[self.LFOV_HOJA]
-
-            # Parte 3: Escritura y formato básico en las hojas de la plantilla
-            self._process_single_sheet(ws_ovl, df_ovl)
-            self._process_single_sheet(ws_lfov, df_lfov)
-
-            # Parte 4: Guardar el archivo de plantilla actualizado (sobrescribe el original)
-            wb.save() # Guarda sobre el archivo original
-            
-            # Cerrar el libro y la aplicación de xlwings
-            wb.close() 
-            app.quit()
-
-            # Mensaje de éxito actualizado
-            messagebox.showinfo("Éxito", f"Proceso completado: El archivo se encuentra en: {template_path}", parent=self.master)
-            self.status_label.config(text="¡Procesamiento completado con éxito! Plantilla actualizada.")
-            
+            advertencias = []
+            hojas = self.processor.prepare(origin_path, advertencias)
+            for titulo, mensaje in advertencias:
+                self.events.put(('advertencia', titulo, mensaje))
+
+            # Partes 2 a 4: Escritura en la plantilla y guardado (sobrescribe el original)
+            self.processor.write_template(writer, template_path, hojas)
+            writer.quit()
+
             processed_successfully = True
+            self.events.put(('exito', template_path))
 
+        except ProcesamientoCancelado:
+            self.events.put(('cancelado',))
+        except FacturacionError as e:
+            self.events.put(('error', e.titulo, e.mensaje, e.estado))
         except FileNotFoundError:
-            messagebox.showerror("Error", f"Uno de los archivos de Excel no fue encontrado. Verifique las rutas.", parent=self.master)
-            self.status_label.config(text="Error: Archivos no encontrados.")
+            self.events.put(('error', "Error", "Uno de los archivos de Excel no fue encontrado. Verifique las rutas.", "Error: Archivos no encontrados."))
             print(f"ERROR: FileNotFoundError - Uno de los archivos no fue encontrado. Ruta origen: {origin_path}, Ruta plantilla: {template_path}", file=sys.stderr)
         except KeyError as e:
-            messagebox.showerror("Error de Columna", f"Una columna esperada no fue encontrada. Asegúrese de que los encabezados sean correctos. Detalle: {e}", parent=self.master)
-            self.status_label.config(text=f"Error: Columna faltante ({e}).")
+            self.events.put(('error', "Error de Columna", f"Una columna esperada no fue encontrada. Asegúrese de que los encabezados sean correctos. Detalle: {e}", f"Error: Columna faltante ({e})."))
             print(f"ERROR: KeyError - Columna faltante. Detalle: {e}", file=sys.stderr)
         except Exception as e:
-            messagebox.showerror("Error Inesperado", f"Ocurrió un error inesperado durante el procesamiento: {e}", parent=self.master)
+            self.events.put(('error', "Error Inesperado", f"Ocurrió un error inesperado durante el procesamiento: {e}", "Error inesperado durante el procesamiento."))
             print(f"ERROR: Ocurrió un error inesperado durante el procesamiento: {e}", file=sys.stderr)
-            self.status_label.config(text="Error inesperado durante el procesamiento.")
         finally:
             try:
-                if not processed_successfully and app and app.alive:
-                    if app.books:
-                        for open_wb in app.books:
-                            try:
-                                open_wb.close(False)
-                            except Exception as e_close_wb:
-                                print(f"WARNING: Error al cerrar el libro en el bloque finally: {e_close_wb}", file=sys.stderr)
-                    app.quit()
+                if not processed_successfully and writer:
+                    try:
+                        writer.close(save=False)
+                    except Exception as e_close_wb:
+                        print(f"WARNING: Error al cerrar el libro en el bloque finally: {e_close_wb}", file=sys.stderr)
+                    writer.quit()
             except Exception as e_quit:
-                print(f"ERROR: Error al intentar cerrar la aplicación de Excel en finally: {e_quit}", file=sys.stderr)
-            self.master.after(100, lambda: self.master.focus_force())
-            
-            if processed_successfully:
+                print(f"ERROR: Error al intentar cerrar el motor de escritura en finally: {e_quit}", file=sys.stderr)
+            if self.processor.report is not None:
+                try:
+                    self.processor.report.save(self.RUTA_REPORTE, origen=origin_path, plantilla=template_path, motor=motor,
+                                               correcto=processed_successfully)
+                except Exception as e_reporte:
+                    print(f"WARNING: No se pudo guardar el reporte de tiempos: {e_reporte}", file=sys.stderr)
+            self.events.put(('fin',))
+
+    def _poll_events(self):
+        """Atiende en el hilo de Tk los eventos enviados por el hilo de trabajo."""
+        terminado = False
+        while True:
+            try:
+                evento = self.events.get_nowait()
+            except queue.Empty:
+                break
+            tipo = evento[0]
+            if tipo == 'progreso':
+                _, paso, total, descripcion, filas = evento
+                self.progress_bar['value'] = 100 * (paso - 1) / total
+                detalle = f" ({filas:,} filas)" if filas is not None else ""
+                self.status_label.config(text=f"Paso {paso} de {total}: {descripcion}{detalle}...")
+            elif tipo == 'advertencia':
+                messagebox.showwarning(evento[1], evento[2], parent=self.master)
+            elif tipo == 'error':
+                _, titulo, mensaje, estado = evento
+                messagebox.showerror(titulo, mensaje, parent=self.master)
+                self.status_label.config(text=estado)
+            elif tipo == 'cancelado':
+                self.progress_bar['value'] = 0
+                self.status_label.config(text="Procesamiento cancelado. La plantilla no fue modificada.")
+            elif tipo == 'exito':
+                template_path = evento[1]
+                self.progress_bar['value'] = 100
+                # Mensaje de éxito actualizado
+                messagebox.showinfo("Éxito", f"Proceso completado: El archivo se encuentra en: {template_path}", parent=self.master)
+                self.status_label.config(text="¡Procesamiento completado con éxito! Plantilla actualizada.")
                 try:
                     # Abre el archivo original que acaba de ser sobrescrito
                     subprocess.Popen(['start', '', template_path], shell=True)
                 except Exception as e_reopen:
                     print(f"ERROR: No se pudo re-abrir el archivo procesado: {e_reopen}", file=sys.stderr)
                     messagebox.showwarning("Advertencia", f"El procesamiento se completó, pero no se pudo re-abrir el archivo:\n{template_path}\nError: {e_reopen}", parent=self.master)
+            elif tipo == 'fin':
+                terminado = True
+
+        if terminado:
+            self._set_processing(False)
+            self.master.after(100, lambda: self.master.focus_force())
+        else:
+            self.master.after(self.INTERVALO_SONDEO_MS, self._poll_events)
 
 
 if __name__ == "__main__":
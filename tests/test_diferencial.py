@@ -0,0 +1,112 @@
+# tests/test_diferencial.py
+"""
+El modo diferencial (_update_single_sheet) debe dejar la hoja igual que una reescritura
+completa (_process_single_sheet), con cualquier combinación de facturas insertadas,
+eliminadas, modificadas o reordenadas.
+"""
+import shutil
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from facturacion.processor import FacturacionProcessor
+from facturacion.writers import OpenpyxlWriter
+
+HOJA = "FACTURACION OVL"
+
+
+def _invoices(rng, filas, primer_folio=1):
+    return pd.DataFrame({
+        'EMISOR': 'OVL',
+        'NOMBRE O RAZON SOCIAL': rng.choice([f"CLIENTE {i:02d}" for i in range(15)], filas),
+        'TIPO DE DOCUMENTO': 'FACTURA',
+        'CONCEPTO': rng.choice(['RENTA', 'MANTENIMIENTO'], filas),
+        'FOLIO': np.arange(primer_folio, primer_folio + filas),
+        'CONTRATO': rng.choice(['C-1', 'C-2', 'C-3'], filas),
+        'PERIODO DE RENTA': 'ENERO',
+        'SALDO PENDIENTE': rng.integers(1, 10000, filas).astype(float),
+        'FECHA DE PAGO': pd.to_datetime('2024-01-01') + pd.to_timedelta(rng.integers(0, 400, filas), unit='D'),
+        'AGENTE': rng.choice(['ELVIRA', 'CARLOS', 'OTRO'], filas),
+    })
+
+
+def _edit(rng, df):
+    """Elimina, modifica, inserta y (a veces) reordena facturas al azar."""
+    df = df.drop(index=rng.choice(df.index, min(len(df), int(rng.integers(0, 6))), replace=False))
+    for indice in rng.choice(df.index, min(len(df), int(rng.integers(0, 6))), replace=False):
+        df.loc[indice, 'SALDO PENDIENTE'] += 1
+        df.loc[indice, 'AGENTE'] = rng.choice(['ELVIRA', 'CARLOS', 'OTRO'])
+    nuevas = _invoices(rng, int(rng.integers(0, 6)), primer_folio=10000 + int(rng.integers(0, 1000)))
+    for fila in range(len(nuevas)):
+        posicion = int(rng.integers(0, len(df) + 1))
+        df = pd.concat([df.iloc[:posicion], nuevas.iloc[[fila]], df.iloc[posicion:]])
+    if rng.random() < 0.2:
+        df = df.sample(frac=1, random_state=int(rng.integers(0, 1000)))
+    return df.reset_index(drop=True)
+
+
+def _template(path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = HOJA
+    ws.append(list(_invoices(np.random.default_rng(0), 0).columns))
+    wb.save(path)
+
+
+def _cells(ws, num_cols):
+    """Valor, relleno y (si hay valor) formato de número de cada celda de datos."""
+    celdas = {}
+    for fila in ws.iter_rows(min_row=2, max_col=num_cols):
+        for cell in fila:
+            if cell.value is None and cell.fill.fill_type is None:
+                continue
+            formato = cell.number_format if cell.value is not None else None
+            celdas[cell.coordinate] = (cell.value, cell.fill.fill_type, cell.fill.fgColor.rgb, formato)
+    return celdas
+
+
+def _write(path, df, modo):
+    procesador = FacturacionProcessor()
+    writer = OpenpyxlWriter()
+    writer.open(str(path))
+    if modo == 'completo':
+        procesador._process_single_sheet(writer, HOJA, df)
+        reporte = None
+    else:
+        reporte = procesador._update_single_sheet(writer, HOJA, df)
+    writer.save()
+    writer.close()
+    return reporte
+
+
+@pytest.mark.parametrize("semilla", range(40))
+def test_differential_matches_full_rewrite(tmp_path, semilla):
+    rng = np.random.default_rng(semilla)
+    anterior = _invoices(rng, int(rng.integers(0, 80)))
+    nuevo = _edit(rng, anterior.copy())
+
+    _template(tmp_path / "base.xlsx")
+    _write(tmp_path / "base.xlsx", anterior, 'completo')
+    shutil.copy(tmp_path / "base.xlsx", tmp_path / "completo.xlsx")
+    shutil.copy(tmp_path / "base.xlsx", tmp_path / "diferencial.xlsx")
+    _write(tmp_path / "completo.xlsx", nuevo, 'completo')
+    _write(tmp_path / "diferencial.xlsx", nuevo, 'diferencial')
+
+    num_cols = nuevo.shape[1]
+    completo = _cells(openpyxl.load_workbook(tmp_path / "completo.xlsx")[HOJA], num_cols)
+    diferencial = _cells(openpyxl.load_workbook(tmp_path / "diferencial.xlsx")[HOJA], num_cols)
+    assert diferencial == completo
+
+
+def test_deleting_one_invoice_only_removes_its_row(tmp_path):
+    rng = np.random.default_rng(1)
+    anterior = _invoices(rng, 500)
+    _template(tmp_path / "plantilla.xlsx")
+    _write(tmp_path / "plantilla.xlsx", anterior, 'completo')
+
+    reporte = _write(tmp_path / "plantilla.xlsx", anterior.drop(index=3).reset_index(drop=True), 'diferencial')
+    assert reporte['eliminadas'] == 1
+    assert reporte['filas_escritas'] == 0
+    assert reporte['filas_borradas'] == 1
@@ -0,0 +1,59 @@
+# tests/test_interleave.py
+"""
+Compara FacturacionProcessor._interleave_agents con el algoritmo original (un groupby por
+agente y los grupos de clientes intercalados uno a uno) sobre datos aleatorios.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from facturacion.processor import FacturacionProcessor
+
+
+def _interleave_reference(df_input, agentes):
+    """Algoritmo original: por agente, clientes en orden alfabético; un cliente de cada agente por vuelta."""
+    if df_input.empty:
+        return df_input
+    agente = df_input['AGENTE'].astype(str).str.strip().str.upper()
+    grupos = [iter([grupo for _, grupo in df_input[agente == nombre].groupby('NOMBRE O RAZON SOCIAL', sort=True)])
+              for nombre in agentes]
+    intercalados = []
+    while True:
+        vuelta = [grupo for grupo in (next(it, None) for it in grupos) if grupo is not None]
+        if not vuelta:
+            break
+        intercalados += vuelta
+    if not intercalados:
+        return df_input.iloc[:0]
+    return pd.concat(intercalados, ignore_index=True)
+
+
+def _random_frame(rng, filas):
+    agentes = np.array(['ELVIRA', ' elvira', 'CARLOS', 'carlos ', 'ANA', 'OTRO', None], dtype=object)
+    clientes = np.array([f"CLIENTE {i:03d}" for i in range(rng.integers(1, 40))] + [None], dtype=object)
+    return pd.DataFrame({
+        'AGENTE': rng.choice(agentes, filas),
+        'NOMBRE O RAZON SOCIAL': rng.choice(clientes, filas),
+        'FOLIO': np.arange(filas),
+        'SALDO PENDIENTE': rng.random(filas).round(2),
+    })
+
+
+@pytest.mark.parametrize("semilla", range(200))
+def test_interleave_matches_reference(semilla):
+    rng = np.random.default_rng(semilla)
+    df = _random_frame(rng, int(rng.integers(0, 300)))
+    agentes = list(rng.permutation(['ELVIRA', 'CARLOS', 'ANA'])[:rng.integers(1, 4)])
+
+    resultado = FacturacionProcessor()._interleave_agents(df, agentes)
+    esperado = _interleave_reference(df, agentes)
+
+    pd.testing.assert_frame_equal(resultado.reset_index(drop=True), esperado.reset_index(drop=True),
+                                  check_dtype=False, check_index_type=False)
+
+
+def test_interleave_default_agents():
+    procesador = FacturacionProcessor()
+    df = _random_frame(np.random.default_rng(0), 500)
+    pd.testing.assert_frame_equal(procesador._interleave_agents(df),
+                                  _interleave_reference(df, procesador.AGENTES_INTERCALADOS), check_dtype=False)